@@ -0,0 +1,70 @@
+
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from strativerse import metrics
+
+# Cached API responses are never deleted directly. Instead, every model has a "generation"
+# token that is part of the key of every cached response that depends on it. Saving or
+# deleting an object replaces the token for its model, so that stale entries can no longer
+# be found (they are evicted when they expire). Note that QuerySet.update() sends no signals.
+# Tokens are kept in a cache of their own (STRATIVERSE_API_GENERATION_CACHE), which holds a few
+# dozen keys at most, so that culling responses never drops them.
+
+
+def get_api_cache():
+    return caches[getattr(settings, 'STRATIVERSE_API_CACHE', 'default')]
+
+
+def get_generation_cache():
+    alias = getattr(settings, 'STRATIVERSE_API_GENERATION_CACHE', None)
+    return caches[alias] if alias is not None else get_api_cache()
+
+
+def get_row_cache():
+    # rendered rows (see ViewList.get_row_cache()), or None to render every row every time
+    alias = getattr(settings, 'STRATIVERSE_ROW_CACHE', None)
+    return caches[alias] if alias is not None else None
+
+
+def get_api_cache_timeout():
+    return getattr(settings, 'STRATIVERSE_API_CACHE_TIMEOUT', 600)
+
+
+def _generation_key(model):
+    return 'strativerse-api:generation:' + model._meta.label_lower
+
+
+def get_generations(models):
+    cache = get_generation_cache()
+    keys = sorted(_generation_key(model) for model in models)
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        # a token that was evicted (or never existed) must not match any existing entry
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, None)
+        generations.update(cache.get_many(missing))
+    return [(key, generations.get(key)) for key in keys]
+
+
+def get_cached(key):
+    # a cached response, or None (counted as a hit or a miss)
+    value = get_api_cache().get(key)
+    metrics.record_cache_lookups('api-response', hits=int(value is not None), misses=int(value is None))
+    return value
+
+
+def invalidate_model(model):
+    get_generation_cache().set(_generation_key(model), uuid.uuid4().hex, None)
+
+
+def invalidate_on_change(sender, **kwargs):
+    invalidate_model(sender)
+
+
+def make_key(*parts):
+    return 'strativerse-api:response:' + hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
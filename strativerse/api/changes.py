@@ -0,0 +1,81 @@
+import base64
+import datetime
+import json
+
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from reversion.models import Revision
+
+from strativerse.models import Change
+
+# The change feed lists created, updated, and deleted objects from the Change table, which
+# record_change() and record_deletion() write to from post_save and post_delete (in the same
+# transaction as the change itself, so deletions made anywhere, e.g. by the admin's "delete
+# selected" action or Person.combine_people(), are listed too). The feed is paged by Change id.
+# Ids are handed out when a change is written rather than when its transaction commits, so
+# changes written in the last few seconds (settle_seconds) are held back until any transaction
+# that was still writing an earlier id has had the time to commit. Note that QuerySet.update()
+# and bulk_create() send no signals, so their changes aren't listed.
+
+
+class ChangeFeedError(ValueError):
+    pass
+
+
+def record_change(sender, instance, created=False, raw=False, **kwargs):
+    # a post_save receiver (objects loaded from fixtures aren't changes)
+    if raw:
+        return
+    Change.objects.create(
+        model_name=sender._meta.model_name, object_id=instance.pk, action='created' if created else 'updated'
+    )
+
+
+def record_deletion(sender, instance, **kwargs):
+    # a post_delete receiver
+    Change.objects.create(model_name=sender._meta.model_name, object_id=instance.pk, action='deleted')
+
+
+def encode_cursor(change_id):
+    return base64.urlsafe_b64encode(json.dumps([change_id]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        change_id, = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError, UnicodeError):
+        raise ChangeFeedError('Invalid cursor: "%s"' % cursor)
+    if not isinstance(change_id, int):
+        raise ChangeFeedError('Invalid cursor: "%s"' % cursor)
+    return change_id
+
+
+def parse_since(since):
+    # the id of the last change made at or before a revision (by id) or an ISO 8601 timestamp
+    if since.isdigit():
+        timestamp = Revision.objects.filter(pk=int(since)).values_list('date_created', flat=True).first()
+        if timestamp is None:
+            raise ChangeFeedError('No revision with id %s' % since)
+    else:
+        timestamp = parse_datetime(since)
+        if timestamp is None:
+            raise ChangeFeedError('"since" must be a revision id or an ISO 8601 timestamp')
+    return Change.objects.filter(timestamp__lte=timestamp).aggregate(last=Max('pk'))['last'] or 0
+
+
+def get_changes(model_names, after_id, limit=1000, settle_seconds=0):
+    # (changes, has_more), where each change is a Change, for the changes to the given models
+    # after after_id, stopping at the first one that is too recent to be handed out
+    cutoff = timezone.now() - datetime.timedelta(seconds=settle_seconds)
+    changes = []
+    has_more = False
+    queryset = Change.objects.filter(pk__gt=after_id, model_name__in=model_names).order_by('pk')
+    for change in queryset[:limit + 1]:
+        if change.timestamp > cutoff:
+            break
+        if len(changes) == limit:
+            has_more = True
+            break
+        changes.append(change)
+    return changes, has_more
@@ -0,0 +1,184 @@
+
+import json
+import logging
+import queue
+import select
+import threading
+import time
+
+import reversion
+from django.db import connections, transaction
+
+from strativerse.api.changes import encode_cursor
+
+logger = logging.getLogger(__name__)
+
+# Change events ({'model', 'id', 'action', 'revision', 'change', 'cursor'}) are sent when the
+# transaction that wrote their Change row commits, and handed to every connected client by one broker per process.
+# With PostgreSQL, events are sent through NOTIFY instead, and each process has a single thread
+# that LISTENs for them, so that events from every process reach every client without a
+# database connection per client. Note that each connected client still holds a worker thread
+# (Django < 4.2 can't stream responses asynchronously), so the number of clients per process is
+# capped (see StrativerseAPIv1.events_view()).
+
+NOTIFY_CHANNEL = 'strativerse_events'
+
+# the events of the revision that is being made in this thread, whose id is only known once the
+# revision is saved (after the changes it records)
+_revision_events = threading.local()
+
+
+class EventBroker:
+
+    def __init__(self, using='default'):
+        self.using = using
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.listener = None
+
+    def uses_notify(self):
+        return connections[self.using].vendor == 'postgresql'
+
+    def subscribe(self, callback, limit=None):
+        # callback(event) is called (from any thread) for every event until unsubscribe(), unless
+        # there are already `limit` subscribers (in which case None is returned)
+        if self.uses_notify():
+            self.start_listener()
+        token = object()
+        with self.lock:
+            if limit is not None and len(self.subscribers) >= limit:
+                return None
+            self.subscribers[token] = callback
+        return token
+
+    def unsubscribe(self, token):
+        with self.lock:
+            self.subscribers.pop(token, None)
+
+    def broadcast(self, event):
+        with self.lock:
+            callbacks = list(self.subscribers.values())
+        for callback in callbacks:
+            callback(event)
+
+    def publish(self, events):
+        # called after the transaction that made the changes has committed
+        if not self.uses_notify():
+            for event in events:
+                self.broadcast(event)
+            return
+        with connections[self.using].cursor() as cursor:
+            for event in events:
+                cursor.execute('SELECT pg_notify(%s, %s)', [NOTIFY_CHANNEL, json.dumps(event)])
+
+    def start_listener(self):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.listen, name='strativerse-events', daemon=True)
+                self.listener.start()
+
+    def listen(self):
+        # one dedicated connection per process, reconnecting if it fails
+        wrapper = connections[self.using]
+        while True:
+            try:
+                connection = wrapper.get_new_connection(wrapper.get_connection_params())
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute('LISTEN ' + NOTIFY_CHANNEL)
+                while True:
+                    if select.select([connection], [], [], 30) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self.broadcast(json.loads(connection.notifies.pop(0).payload))
+            except Exception:
+                logger.exception('Lost the connection listening for change events')
+                time.sleep(5)
+
+
+broker = EventBroker()
+
+
+def subscribe_queue(maxsize=1000, limit=None):
+    # (token, queue.Queue) for a subscriber that receives every event (events for a client that stops
+    # reading are dropped), or (None, None) if there are already `limit` subscribers
+    events = queue.Queue(maxsize=maxsize)
+
+    def put(event):
+        try:
+            events.put_nowait(event)
+        except queue.Full:
+            pass
+
+    token = broker.subscribe(put, limit=limit)
+    return (token, events) if token is not None else (None, None)
+
+
+class EventStream:
+    # the text/event-stream of one client, which unsubscribes when the response is closed
+    # (whether or not it was ever read)
+
+    def __init__(self, token, events, model_names, keepalive=15):
+        self.token = token
+        self.events = events
+        self.model_names = model_names
+        self.keepalive = keepalive
+        self.started = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.token is None:
+            raise StopIteration()
+        if not self.started:
+            self.started = True
+            return 'retry: 5000\n\n'
+        while True:
+            try:
+                event = self.events.get(timeout=self.keepalive)
+            except queue.Empty:
+                return ': keepalive\n\n'
+            if event['model'] in self.model_names:
+                return format_event(event)
+
+    def close(self):
+        if self.token is not None:
+            broker.unsubscribe(self.token)
+            self.token = None
+
+
+def format_event(event):
+    # an event in the text/event-stream format
+    return 'id: %s\nevent: change\ndata: %s\n\n' % (event['change'], json.dumps(event))
+
+
+def change_written(sender, instance, created=False, raw=False, **kwargs):
+    # a post_save receiver for Change rows (see api/changes.py), which are written in the same
+    # transaction as the change itself (including deletions), so every change is sent once it
+    # commits. The revision is None for changes made outside of a revision, and the cursor is
+    # the /changes cursor for the changes after this one.
+    if not created or raw:
+        return
+    event = {
+        'model': instance.model_name,
+        'id': instance.object_id,
+        'action': instance.action,
+        'revision': None,
+        'change': instance.pk,
+        'cursor': encode_cursor(instance.pk)
+    }
+    if reversion.is_active():
+        if not hasattr(_revision_events, 'events'):
+            _revision_events.events = []
+        _revision_events.events.append(event)
+    transaction.on_commit(lambda: broker.publish([event]))
+
+
+def revision_committed(sender, revision, versions, **kwargs):
+    # a post_revision_commit receiver, which is sent before the revision's transaction commits
+    # (and its events are published), unless it was made with create_revision(atomic=False)
+    for event in getattr(_revision_events, 'events', ()):
+        event['revision'] = revision.pk
+    _revision_events.events = []
@@ -1,11 +1,27 @@
 
+import functools
+import hashlib
+import importlib.util
 import json
+from calendar import timegm
+from concurrent.futures import ThreadPoolExecutor
 
+from asgiref.sync import sync_to_async
 from django import http
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import close_old_connections
+from django.db.models import ExpressionWrapper, F, IntegerField, Q
+from django.utils.cache import get_conditional_response, quote_etag
+from django.http import QueryDict
+from django.utils.http import http_date
 
 from strativerse.viewlist import ViewList, ViewField
-from strativerse.models import Feature, Parameter, Person, Publication, Record
+from strativerse.api import cache as api_cache
+from strativerse.api import changes
+from strativerse.api import events as api_events
+from strativerse.models import Authorship, Feature, Parameter, Person, Publication, Record, RecordAuthorship, \
+    RecordParameter, RecordReference
 from strativerse.views import get_model_detail_url
 
 
@@ -31,47 +47,150 @@ class StrativerseAPI:
         raise NotImplementedError()
 
 
+def _wkt(geom):
+    return geom.wkt if hasattr(geom, 'wkt') else geom
+
+
 class StratiViewList(ViewList):
     id = ViewField()
     summary = ViewField(lambda item: str(item))
-    url = ViewField(lambda item: get_model_detail_url(item._meta.model_name, item.pk))
-    created = ViewField(lambda item: str(item.created), sortable=True)
-    modified = ViewField(lambda item: str(item.modified), sortable=True)
+    url = ViewField(lambda item: get_model_detail_url(item._meta.model_name, item.pk), requires=['pk'])
+    created = ViewField(sortable=True, filters={'json': str, 'text': str, 'html': str})
+    modified = ViewField(sortable=True, filters={'json': str, 'text': str, 'html': str})
 
-    prefix = None
+    # an empty prefix (rather than None) keeps the model name out of the query parameters
+    prefix = ''
     search_var = 'q'
     order_var = 'o'
+    fields_var = 'fields'
+    facets_var = 'facets'
+    expand_var = 'expand'
 
-    def __init__(self, request):
-        super().__init__(data=request.GET)
+    # the JSON output never shows the count, so don't pay for more of it than is needed
+    count_strategy = 'capped'
+    row_cache_field = 'modified'
+    related = None
+
+    def __init__(self, request, data=None):
+        super().__init__(data=request.GET if data is None else data)
         self.request = request
 
     def get_paginate_by(self):
         return 1000
 
+    def get_row_cache(self):
+        return api_cache.get_row_cache()
+
     def get_related_viewlist_class(self, model_name):
-        return None
+        # related model name: lookup from the related model back to this one
+        lookup = (self.related or {}).get(model_name)
+        if lookup is None or model_name not in view_lists:
+            return None
+        return get_related_viewlist_class(view_lists[model_name], lookup)
+
+    def get_expandable(self):
+        # relation name: model name (since the classes refer to each other)
+        return {name: get_viewlist_class(model_name) for name, model_name in (self.expandable or {}).items()}
+
+    def make_expansion_viewlist(self, viewlist_class):
+        return viewlist_class(self.request, data=QueryDict())
+
+
+class ThroughViewList(StratiViewList):
+    # the rows of a model that joins two others, which are only shown as expansions
+    summary = None
+    url = None
+    created = None
+    modified = None
+    row_cache_field = None
+
+
+class RelatedViewList:
+    # mixed into a StratiViewList to list the objects related to one or more parent objects
+    parent_lookup = None
+
+    def __init__(self, request, parent_ids, group_by_parent=False):
+        super().__init__(request)
+        self.parent_ids = list(parent_ids)
+        self.group_by_parent = group_by_parent
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.group_by_parent:
+            # one row per (object, parent) pair, from the same join that does the filtering
+            return queryset.filter(**{self.parent_lookup + '__in': self.parent_ids}) \
+                .annotate(related_parent_id=F(self.parent_lookup))
+        else:
+            expression, needs_distinct = self.compile_search_expression(
+                Q(**{self.parent_lookup + '__in': self.parent_ids})
+            )
+            queryset = queryset.filter(expression)
+            return queryset.distinct() if needs_distinct else queryset
+
+    def get_dependency_lookups(self):
+        return super().get_dependency_lookups() + [self.parent_lookup]
+
+    def rows_by_parent(self):
+        # {parent id: [row, ...]} for every parent id, rendered from a single query
+        objects = list(self.assemble_queryset(paginate=False))
+        rows = {parent_id: [] for parent_id in self.parent_ids}
+        for obj, row in zip(objects, self.rowiter_json(objects)):
+            rows.setdefault(obj.related_parent_id, []).append(row)
+        return rows
+
+
+_related_viewlist_classes = {}
+
+
+def get_related_viewlist_class(viewlist_class, parent_lookup):
+    # classes are created once, so that per-class caches (e.g., row plans) keep working
+    key = (viewlist_class, parent_lookup)
+    if key not in _related_viewlist_classes:
+        _related_viewlist_classes[key] = type(
+            'Related' + viewlist_class.__name__,
+            (RelatedViewList, viewlist_class),
+            {'parent_lookup': parent_lookup}
+        )
+    return _related_viewlist_classes[key]
 
 
 class FeatureViewList(StratiViewList):
+    summary = ViewField(lambda item: str(item), requires=['name', 'type'])
     name = ViewField(searchable=True, sortable=True)
     model = Feature
+    facets = {'type': 'type'}
+    expandable = {'parent': 'feature'}
+    related = {
+        'record': 'feature',
+        'feature': 'parent',
+    }
 
 
 class PersonViewList(StratiViewList):
+    summary = ViewField(lambda item: str(item), requires=['given_names', 'last_name'])
     given_names = ViewField(searchable=True)
     last_name = ViewField(searchable=True, sortable=True)
     model = Person
+    expandable = {'authorships': 'authorship', 'record_authorships': 'recordauthorship'}
+    related = {
+        'publication': 'authorships__person',
+        'record': 'record_authorships__person',
+    }
 
 
 class ParameterViewList(StratiViewList):
+    summary = ViewField(lambda item: str(item), requires=['name'])
     name = ViewField(searchable=True)
     slug = ViewField(searchable=True)
     description = ViewField(searchable=True)
     model = Parameter
+    related = {
+        'record': 'record_parameters__parameter',
+    }
 
 
 class PublicationViewList(StratiViewList):
+    summary = ViewField(lambda item: str(item), requires=['slug', 'title'])
     slug = ViewField(search_key='authorships__person__last_name', sortable=True)
     year = ViewField(searchable=True, sortable=True)
     title = ViewField(searchable=True)
@@ -79,50 +198,481 @@ class PublicationViewList(StratiViewList):
     DOI = ViewField(searchable=True)
     URL = ViewField()
     model = Publication
+    facets = {
+        'type': 'type',
+        'decade': ExpressionWrapper(F('year') / 10 * 10, output_field=IntegerField()),
+    }
+    expandable = {'authorships': 'authorship', 'record_uses': 'recordreference'}
+    related = {
+        'person': 'authorships__publication',
+        'record': 'record_uses__publication',
+    }
 
 
 class RecordViewList(StratiViewList):
     model = Record
+    summary = ViewField(lambda item: str(item), requires=['name'])
+    name = ViewField(searchable=True, sortable=True)
+    date_collected = ViewField(sortable=True, filters={'json': str})
+    medium = ViewField()
+    type = ViewField()
+    min_year = ViewField(sortable=True)
+    max_year = ViewField(sortable=True)
+    resolution = ViewField(sortable=True)
+    geometry = ViewField(filters={'json': _wkt, 'text': _wkt})
     feature_id = ViewField(search_key='feature__name')
+    facets = {
+        'medium': 'medium',
+        'type': 'type',
+        'feature_type': 'feature__type',
+        'parameter': 'record_parameters__parameter__slug',
+        'publication_decade': ExpressionWrapper(F('record_uses__publication__year') / 10 * 10, output_field=IntegerField()),
+    }
+    expandable = {
+        'feature': 'feature',
+        'record_authorships': 'recordauthorship',
+        'record_uses': 'recordreference',
+        'record_parameters': 'recordparameter',
+    }
+    related = {
+        'feature': 'records',
+        'person': 'record_authorships__record',
+        'publication': 'record_uses__record',
+        'parameter': 'record_parameters__record',
+    }
+
+
+class AuthorshipViewList(ThroughViewList):
+    model = Authorship
+    publication_id = ViewField()
+    person_id = ViewField()
+    role = ViewField()
+    order = ViewField()
+    expandable = {'publication': 'publication', 'person': 'person'}
+
+
+class RecordAuthorshipViewList(ThroughViewList):
+    model = RecordAuthorship
+    record_id = ViewField()
+    person_id = ViewField()
+    role = ViewField()
+    order = ViewField()
+    expandable = {'record': 'record', 'person': 'person'}
+
+
+class RecordReferenceViewList(ThroughViewList):
+    model = RecordReference
+    record_id = ViewField()
+    publication_id = ViewField()
+    type = ViewField()
+    description = ViewField()
+    expandable = {'record': 'record', 'publication': 'publication'}
+
+
+class RecordParameterViewList(ThroughViewList):
+    model = RecordParameter
+    record_id = ViewField()
+    parameter_id = ViewField()
+    units = ViewField()
+    description = ViewField()
+    expandable = {'record': 'record', 'parameter': 'parameter'}
+
+
+view_lists = {
+    'feature': FeatureViewList,
+    'parameter': ParameterViewList,
+    'person': PersonViewList,
+    'publication': PublicationViewList,
+    'record': RecordViewList,
+}
+
+# the models that are only listed as expansions (e.g., ?expand=authorships.person)
+through_view_lists = {
+    'authorship': AuthorshipViewList,
+    'recordauthorship': RecordAuthorshipViewList,
+    'recordreference': RecordReferenceViewList,
+    'recordparameter': RecordParameterViewList,
+}
+
+
+def get_viewlist_class(model_name):
+    return view_lists.get(model_name) or through_view_lists[model_name]
 
 
 class StrativerseAPIv1(StrativerseAPI):
+    format_var = 'format'
+    profile_var = 'profile'
+    modified_field = 'modified'
+
+    # format name: (content type, file extension)
+    export_formats = {
+        'csv': ('text/csv', 'csv'),
+        'tsv': ('text/tab-separated-values', 'tsv'),
+        'ndjson': ('application/x-ndjson', 'ndjson'),
+        'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+        'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    }
+
+    batch_size_limit = 100
+    bulk_size_limit = 10000
+    change_feed_limit = 1000
+    event_keepalive = 15
+    event_retry_after = 30
 
     def get_view_list(self, request, model_name):
-        model_name = model_name.lower()
-        if model_name == 'feature':
-            viewlist = FeatureViewList
-        elif model_name == 'parameter':
-            viewlist = ParameterViewList
-        elif model_name == 'person':
-            viewlist = PersonViewList
-        elif model_name == 'publication':
-            viewlist = PublicationViewList
-        elif model_name == 'record':
-            viewlist = RecordViewList
-        else:
+        viewlist = view_lists.get(model_name.lower())
+        if viewlist is None:
             return None
-
-        return viewlist(request)
+        viewlist = viewlist(request)
+        if self.is_profiling(request):
+            viewlist.enable_profiling()
+        return viewlist
+
+    def is_profiling(self, request):
+        # list profiles (see ViewListProfile) are opt-in: every request is profiled with
+        # STRATIVERSE_PROFILE_VIEWLISTS, or requests with ?profile=1 from staff (or anyone with DEBUG)
+        if getattr(settings, 'STRATIVERSE_PROFILE_VIEWLISTS', False):
+            return True
+        if not request.GET.get(self.profile_var):
+            return False
+        user = getattr(request, 'user', None)
+        return settings.DEBUG or (user is not None and user.is_staff)
+
+    def profiled_stream(self, profile, content):
+        # the profile of a streamed export is only complete (and logged) once the stream ends
+        try:
+            yield from content
+        finally:
+            profile.log()
 
     def detail_view(self, request, model_name, pk):
         viewlist = self.get_view_list(request, model_name)
         if viewlist is None:
             return ErrorResponse(404, f'No such type: "{model_name}"')
+        error = self.check_view_list(viewlist)
+        if error is not None:
+            return error
+
+        # a single-column lookup is enough to answer a conditional request
+        modified = viewlist.get_queryset().filter(pk=pk).values_list(self.modified_field, flat=True).first()
+        if modified is None:
+            return ErrorResponse(404, f'No {model_name} with id {pk}')
+        etag, last_modified = self.get_validators(request, model_name, viewlist, pk, modified)
+        response = self.get_conditional_response(request, etag, last_modified)
+        if response is not None:
+            return response
+
         try:
-            obj = viewlist.model.objects.get(pk=pk)
+            obj = viewlist.finalize_queryset(viewlist.get_queryset()).get(pk=pk)
             dct = viewlist.row_json(obj)
-            return http.HttpResponse(json.dumps(dct), content_type='application/json')
+            response = http.HttpResponse(json.dumps(dct), content_type='application/json')
+            return self.set_validators(response, etag, last_modified)
         except ObjectDoesNotExist:
             return ErrorResponse(404, f'No {model_name} with id {pk}')
 
+    def bulk_view(self, request, model_name):
+        # many objects by id (?ids=1,2,3, or a POST body with a JSON list of ids or {"ids": [...]})
+        viewlist = self.get_view_list(request, model_name)
+        if viewlist is None:
+            return ErrorResponse(404, f'No such type: "{model_name}"')
+        error = self.check_view_list(viewlist)
+        if error is not None:
+            return error
+
+        try:
+            if request.method == 'POST':
+                ids = json.loads(request.body.decode('utf-8'))
+                if isinstance(ids, dict):
+                    ids = ids.get('ids', [])
+                if not isinstance(ids, list):
+                    raise ValueError()
+            else:
+                ids = [value for value in request.GET.get('ids', '').split(',') if value.strip()]
+            ids = list(dict.fromkeys(int(value) for value in ids))
+        except (ValueError, TypeError):
+            return ErrorResponse(400, 'ids must be a list of integers')
+        if len(ids) > self.bulk_size_limit:
+            return ErrorResponse(400, f'At most {self.bulk_size_limit} ids can be requested at once')
+
+        objects = viewlist.finalize_queryset(viewlist.get_queryset()).in_bulk(ids)
+        found = [objects[pk] for pk in ids if pk in objects]
+        content = {
+            'objects': list(viewlist.rowiter_json(found)),
+            'missing': [pk for pk in ids if pk not in objects]
+        }
+        return http.HttpResponse(json.dumps(content), content_type='application/json')
+
+    def changes_view(self, request):
+        # objects created, updated, or deleted since ?since=<revision id or timestamp>, continued
+        # with ?cursor=<cursor from the previous response>
+        try:
+            if 'cursor' in request.GET:
+                after_id = changes.decode_cursor(request.GET['cursor'])
+            elif 'since' in request.GET:
+                after_id = changes.parse_since(request.GET['since'])
+            else:
+                return ErrorResponse(400, 'One of "since" or "cursor" is required')
+        except changes.ChangeFeedError as e:
+            return ErrorResponse(400, str(e))
+        try:
+            limit = max(1, min(int(request.GET.get('limit', self.change_feed_limit)), self.change_feed_limit))
+        except ValueError:
+            return ErrorResponse(400, 'limit must be an integer')
+
+        feed, has_more = changes.get_changes(
+            list(view_lists), after_id, limit=limit,
+            settle_seconds=getattr(settings, 'STRATIVERSE_CHANGE_FEED_SETTLE_SECONDS', 2)
+        )
+
+        # the current state of created and updated objects, with one query per model
+        rows = {}
+        for model_name, viewlist_class in view_lists.items():
+            pks = {change.object_id for change in feed
+                   if change.model_name == model_name and change.action != 'deleted'}
+            if pks:
+                viewlist = viewlist_class(request, data=QueryDict())
+                objects = viewlist.finalize_queryset(viewlist.get_queryset()).in_bulk(pks)
+                rows[model_name] = dict(zip(objects, viewlist.rowiter_json(list(objects.values()))))
+
+        content = {
+            'changes': [
+                {
+                    'model': change.model_name,
+                    'id': change.object_id,
+                    'action': change.action,
+                    'timestamp': change.timestamp.isoformat(),
+                    # (None for objects that have been deleted since)
+                    'object': rows.get(change.model_name, {}).get(change.object_id)
+                    if change.action != 'deleted' else None
+                }
+                for change in feed
+            ],
+            'cursor': changes.encode_cursor(feed[-1].pk if feed else after_id),
+            'has_more': has_more
+        }
+        return http.HttpResponse(json.dumps(content), content_type='application/json')
+
+    def events_view(self, request):
+        # a text/event-stream of changes as they are committed (?models=record,publication for some models);
+        # each client holds a worker thread for as long as it is connected, so their number is capped
+        model_names = self.get_event_model_names(request)
+        if isinstance(model_names, http.HttpResponse):
+            return model_names
+        token, events = api_events.subscribe_queue(limit=getattr(settings, 'STRATIVERSE_EVENTS_MAX_CLIENTS', 50))
+        if token is None:
+            response = ErrorResponse(503, 'Too many clients are connected to the event stream')
+            response['Retry-After'] = str(self.event_retry_after)
+            return response
+        return self.event_stream_response(
+            api_events.EventStream(token, events, model_names, keepalive=self.event_keepalive)
+        )
+
+    def get_event_model_names(self, request):
+        model_names = [name.strip() for name in request.GET.get('models', '').split(',') if name.strip()]
+        unknown = [name for name in model_names if name not in view_lists]
+        if unknown:
+            return ErrorResponse(400, 'Unknown model(s): ' + ', '.join(unknown))
+        return set(model_names or view_lists)
+
+    def event_stream_response(self, stream):
+        response = http.StreamingHttpResponse(stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # stops nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
     def list_view(self, request, model_name):
         viewlist = self.get_view_list(request, model_name)
         if viewlist is None:
             return ErrorResponse(404, f'No such type: "{model_name}"')
-        return http.HttpResponse(viewlist.as_json(), content_type='application/json')
+
+        error = self.check_view_list(viewlist)
+        if error is not None:
+            return error
+
+        export_format = request.GET.get(self.format_var, 'json')
+        if export_format != 'json' and export_format not in self.export_formats:
+            return ErrorResponse(400, f'Unknown format: "{export_format}"')
+
+        # JSON pages are cached along with their validators (exports are streamed, never cached)
+        cache_key = None
+        if export_format == 'json':
+            cache_key = self.get_list_cache_key(request, model_name, viewlist)
+            # (profiled requests skip the cache, which would leave nothing to profile)
+            cached = api_cache.get_cached(cache_key) if viewlist.profile is None else None
+            if cached is not None:
+                etag, last_modified, content = cached
+                response = self.get_conditional_response(request, etag, last_modified)
+                if response is None:
+                    response = http.HttpResponse(content, content_type='application/json')
+                return self.set_validators(response, etag, last_modified)
+
+        with viewlist.profile_stage('validators'):
+            count, _ = viewlist.count_rows()
+        etag, last_modified = self.get_list_validators(request, model_name, viewlist, count)
+        response = self.get_conditional_response(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        if export_format == 'json':
+            content = viewlist.as_json()
+            api_cache.get_api_cache().set(
+                cache_key, (etag, last_modified, content), api_cache.get_api_cache_timeout()
+            )
+            response = http.HttpResponse(content, content_type='application/json')
+            if viewlist.profile is not None:
+                response['Server-Timing'] = viewlist.profile.server_timing()
+                viewlist.profile.log()
+        else:
+            response = self.export_response(viewlist, export_format)
+            if viewlist.profile is not None and response.streaming:
+                response.streaming_content = self.profiled_stream(viewlist.profile, response.streaming_content)
+        return self.set_validators(response, etag, last_modified)
+
+    def facets_view(self, request, model_name):
+        viewlist = self.get_view_list(request, model_name)
+        if viewlist is None:
+            return ErrorResponse(404, f'No such type: "{model_name}"')
+
+        unknown_facets = viewlist.get_unknown_facet_names()
+        if unknown_facets:
+            return ErrorResponse(400, 'Unknown facet(s): ' + ', '.join(unknown_facets))
+
+        # facet counts are cached like list pages, and are invalidated by the same changes
+        cache_key = self.get_list_cache_key(request, model_name, viewlist, 'facets')
+        content = api_cache.get_cached(cache_key)
+        if content is None:
+            counts = viewlist.facet_counts()
+            content = json.dumps({
+                name: [{'value': value, 'count': count} for value, count in values]
+                for name, values in counts.items()
+            })
+            api_cache.get_api_cache().set(cache_key, content, api_cache.get_api_cache_timeout())
+        return http.HttpResponse(content, content_type='application/json')
+
+    def check_view_list(self, viewlist):
+        # an error response for a request with unknown fields or expansions, or None
+        unknown_fields = viewlist.get_unknown_field_names()
+        if unknown_fields:
+            return ErrorResponse(400, 'Unknown field(s): ' + ', '.join(unknown_fields))
+        unknown_expansions = viewlist.get_unknown_expand_paths()
+        if unknown_expansions:
+            return ErrorResponse(400, 'Unknown expansion(s): ' + ', '.join(unknown_expansions))
+        return None
+
+    def get_list_cache_key(self, request, model_name, viewlist, kind='list', *extra):
+        # the generations are looked up before the response is built, so that an edit made
+        # while it is being built leaves it under a key that is already out of date
+        query = sorted((key, value) for key, values in request.GET.lists() for value in values)
+        generations = api_cache.get_generations(viewlist.get_dependent_models())
+        return api_cache.make_key(kind, model_name, *extra, type(viewlist).__qualname__, query, generations)
+
+    def make_etag(self, request, model_name, *state):
+        # an ETag for this representation (model, query string, and object state)
+        query = sorted((key, value) for key, values in request.GET.lists() for value in values)
+        digest = hashlib.md5(repr((model_name, query, state)).encode('utf-8')).hexdigest()
+        return quote_etag(digest)
+
+    def get_validators(self, request, model_name, viewlist, *state):
+        # an ETag and a Last-Modified timestamp for a single object
+        modified = state[-1]
+        last_modified = timegm(modified.utctimetuple()) if modified is not None else None
+        if viewlist.expansions:
+            # expanded objects have their own modification times, which aren't part of the state,
+            # but every change to them changes the cache generations of their models
+            state = (api_cache.get_generations(viewlist.get_dependent_models()), ) + state
+            last_modified = None
+        return self.make_etag(request, model_name, *state), last_modified
+
+    def get_list_validators(self, request, model_name, viewlist, count):
+        # an ETag (and no Last-Modified) for a list: the newest modification time doesn't change
+        # when an object is deleted or when the objects it is linked to change, so a list can't
+        # be validated by date. The cache generations change whenever an object of any model
+        # that the list depends on is saved or deleted, and the number of matching objects (as
+        # the paginator counts them, which is capped, and reused for the page) changes with rows
+        # that are added or removed without signals, e.g. by bulk_create().
+        generations = api_cache.get_generations(viewlist.get_dependent_models())
+        return self.make_etag(request, model_name, generations, count), None
+
+    def get_conditional_response(self, request, etag, last_modified):
+        # a 304 (or 412) response if the client's copy is current, otherwise None
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            response = self.set_validators(response, etag, last_modified)
+        return response
+
+    def set_validators(self, response, etag, last_modified):
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def export_response(self, viewlist, export_format):
+        # exports ignore pagination and stream every matching row
+        if export_format == 'csv':
+            rows = viewlist.rowiter_delimited(viewlist.assemble_queryset(paginate=False), delimiter=',')
+        elif export_format == 'tsv':
+            rows = viewlist.rowiter_delimited(viewlist.assemble_queryset(paginate=False), delimiter='\t')
+        elif export_format == 'ndjson':
+            rows = viewlist.rowiter_ndjson(viewlist.assemble_queryset(paginate=False))
+        elif export_format in ('arrow', 'parquet'):
+            # (pyarrow is optional, and is imported by the ViewList when the rows are written)
+            if importlib.util.find_spec('pyarrow') is None:
+                return ErrorResponse(501, f'The "{export_format}" format requires the pyarrow package')
+            rows = viewlist.rowiter_arrow(export_format)
+        else:
+            raise ValueError(f'Unknown export format: "{export_format}"')
+
+        content_type, extension = self.export_formats[export_format]
+        response = http.StreamingHttpResponse(rows, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{viewlist.model._meta.model_name}.{extension}"'
+        return response
 
     def related_view(self, request, model_name, pk, related_model_name):
+        related_viewlist = self.get_related_view_list(request, model_name, related_model_name, [int(pk)])
+        if isinstance(related_viewlist, http.HttpResponse):
+            return related_viewlist
+
+        cache_key = self.get_list_cache_key(request, f'{model_name}/{pk}', related_viewlist, related_model_name)
+        content = api_cache.get_cached(cache_key)
+        if content is None:
+            content = related_viewlist.as_json()
+            # only check that the parent exists if nothing is related to it
+            if content == '[]' and not view_lists[model_name.lower()].model.objects.filter(pk=pk).exists():
+                return ErrorResponse(404, f'No {model_name} with id {pk}')
+            api_cache.get_api_cache().set(cache_key, content, api_cache.get_api_cache_timeout())
+        return http.HttpResponse(content, content_type='application/json')
+
+    def related_batch_view(self, request, model_name, related_model_name):
+        # the related objects of many parents at once (e.g., ?ids=1,2,3), grouped by parent id
+        try:
+            ids = [int(value) for value in request.GET.get('ids', '').split(',') if value.strip()]
+        except ValueError:
+            return ErrorResponse(400, 'ids must be a comma-separated list of integers')
+        if not ids:
+            return ErrorResponse(400, 'No ids were specified')
+        if len(ids) > self.batch_size_limit:
+            return ErrorResponse(400, f'At most {self.batch_size_limit} ids can be requested at once')
+
+        related_viewlist = self.get_related_view_list(
+            request, model_name, related_model_name, ids, group_by_parent=True
+        )
+        if isinstance(related_viewlist, http.HttpResponse):
+            return related_viewlist
+
+        cache_key = self.get_list_cache_key(request, model_name, related_viewlist, 'related-batch', related_model_name)
+        content = api_cache.get_cached(cache_key)
+        if content is None:
+            rows = related_viewlist.rows_by_parent()
+            content = json.dumps({str(parent_id): parent_rows for parent_id, parent_rows in rows.items()})
+            api_cache.get_api_cache().set(cache_key, content, api_cache.get_api_cache_timeout())
+        return http.HttpResponse(content, content_type='application/json')
+
+    def get_related_view_list(self, request, model_name, related_model_name, parent_ids, group_by_parent=False):
+        # the related ViewList, or an error response
         viewlist = self.get_view_list(request, model_name)
         if viewlist is None:
             return ErrorResponse(404, f'No such type: "{model_name}"')
@@ -131,12 +681,51 @@ class StrativerseAPIv1(StrativerseAPI):
         if related_viewlist_class is None:
             return ErrorResponse(404, f'No {related_model_name} objects are related to {model_name} objects')
 
-        try:
-            obj = viewlist.model.objects.get(pk=pk)
-            related_viewlist = related_viewlist_class(request, obj)
-            return http.HttpResponse(related_viewlist.as_json(), content_type='application/json')
-        except ObjectDoesNotExist:
-            return ErrorResponse(404, f'No {model_name} with id {pk}')
+        related_viewlist = related_viewlist_class(request, parent_ids, group_by_parent=group_by_parent)
+        error = self.check_view_list(related_viewlist)
+        if error is not None:
+            return error
+        return related_viewlist
+
+
+@functools.lru_cache(maxsize=None)
+def get_async_executor():
+    # the threads that the async views run their database work in (each with its own connections)
+    return ThreadPoolExecutor(
+        max_workers=getattr(settings, 'STRATIVERSE_API_ASYNC_THREADS', 16), thread_name_prefix='strativerse-api'
+    )
+
+
+def run_in_async_executor(view, *args):
+    # (runs in a pool thread, which closes its connections when they are too old, as request
+    # threads do when requests start and finish)
+    close_old_connections()
+    try:
+        return view(*args)
+    finally:
+        close_old_connections()
+
+
+class AsyncStrativerseAPIv1(StrativerseAPIv1):
+    # The detail, list, and related views for ASGI servers (see strativerse_impl/asgi.py). Under
+    # ASGI, Django 3.2 runs all synchronous code in a single thread, so these views run the
+    # synchronous ones in a bounded pool of threads instead, and the event loop serves other
+    # clients while their queries run. Streaming responses (exports and the event stream) aren't
+    # served by these views, since Django 3.2 iterates them in the event loop.
+
+    async def detail_view(self, request, model_name, pk):
+        return await self.run_view(super().detail_view, request, model_name, pk)
+
+    async def list_view(self, request, model_name):
+        return await self.run_view(super().list_view, request, model_name)
+
+    async def related_view(self, request, model_name, pk, related_model_name):
+        return await self.run_view(super().related_view, request, model_name, pk, related_model_name)
+
+    async def run_view(self, view, *args):
+        run = sync_to_async(run_in_async_executor, thread_sensitive=False, executor=get_async_executor())
+        return await run(view, *args)
 
 
 api = StrativerseAPIv1()
+async_api = AsyncStrativerseAPIv1()
@@ -1,5 +1,36 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from reversion.signals import post_revision_commit
 
 
 class StrativerseConfig(AppConfig):
     name = 'strativerse'
+
+    def ready(self):
+        from .api.cache import invalidate_on_change
+        from .api.changes import record_change, record_deletion
+        from .api.events import change_written, revision_committed
+        from .api.v1 import view_lists
+        from .metrics import install_request_wrappers
+        from .models import Change
+
+        # connecting per model (rather than to every sender) keeps fast deletes working
+        # for models outside this app
+        for model in self.get_models():
+            if model is Change:
+                continue
+            post_save.connect(invalidate_on_change, sender=model, dispatch_uid='strativerse-api-cache')
+            post_delete.connect(invalidate_on_change, sender=model, dispatch_uid='strativerse-api-cache')
+
+        # changes to the objects in the change feed are written to the Change table
+        for viewlist_class in view_lists.values():
+            post_save.connect(record_change, sender=viewlist_class.model, dispatch_uid='strativerse-change-feed')
+            post_delete.connect(record_deletion, sender=viewlist_class.model, dispatch_uid='strativerse-change-feed')
+
+        # change events are sent when the changes that the Change table lists are committed
+        post_save.connect(change_written, sender=Change, dispatch_uid='strativerse-events')
+        post_revision_commit.connect(revision_committed, dispatch_uid='strativerse-events')
+
+        # queries are counted for requests served through ASGI (see metrics.request_execute_wrapper())
+        connection_created.connect(install_request_wrappers, dispatch_uid='strativerse-request-wrappers')
@@ -0,0 +1,254 @@
+
+import copy
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from strativerse.management.utils import percentile
+from strativerse.metrics import QueryCounter
+from strativerse.models import Feature, Parameter, Person, Publication, Record
+
+# Benchmarks of the hot paths (CSL JSON imports, Record.save(), Person.combine_people(), API
+# lists, and admin changelists) against whatever is in the database, which should be a dataset
+# made by strativerse_generate. Everything runs in a transaction that is rolled back, and every
+# benchmark that writes is rolled back after each iteration, so the data is the same for every
+# run. Results are written as JSON, and --compare prints the change from an earlier result file.
+
+CSL_JSON = os.path.join(os.path.dirname(__file__), '..', '..', 'static', 'strativerse', 'csl', 'test_csl_json.json')
+
+
+class Rollback(Exception):
+    pass
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks imports, record saves, combining people, API lists, and admin changelists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--only', action='append', default=[],
+                            help='Only run benchmarks whose name contains this (can be repeated)')
+        parser.add_argument('--output', default=None, help='Write results to this file (default: stdout)')
+        parser.add_argument('--compare', default=None, help='An earlier result file to compare with')
+        parser.add_argument('--cached', action='store_true',
+                            help='Use the API response and row caches (default: bypass them)')
+        parser.add_argument('--generate', type=int, default=None,
+                            help='Run strativerse_generate with this many publications first')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if options['generate']:
+            call_command('strativerse_generate', publications=options['generate'], seed=options['seed'],
+                         stdout=self.stderr)
+        if not Record.objects.exists():
+            raise CommandError('There are no records to benchmark (see manage.py strativerse_generate)')
+
+        self.rng = random.Random(options['seed'])
+        self.iterations = max(1, options['iterations'])
+        self.warmup = max(0, options['warmup'])
+
+        caches = copy.deepcopy(settings.CACHES)
+        if not options['cached']:
+            for alias in (getattr(settings, 'STRATIVERSE_API_CACHE', 'default'),
+                          getattr(settings, 'STRATIVERSE_ROW_CACHE', None)):
+                if alias is not None:
+                    caches[alias] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+
+        results = []
+        with override_settings(CACHES=caches, ALLOWED_HOSTS=['localhost']):
+            try:
+                with transaction.atomic():
+                    self.client = Client(HTTP_HOST='localhost')
+                    self.client.force_login(User.objects.create_superuser('strativerse-benchmark', '', None))
+                    for name, func, writes, items in self.get_benchmarks():
+                        if options['only'] and not any(only in name for only in options['only']):
+                            continue
+                        self.stderr.write('Running %s' % name)
+                        results.append(self.run_benchmark(name, func, writes, items))
+                    raise Rollback()
+            except Rollback:
+                pass
+
+        output = {'meta': self.get_meta(options), 'results': results}
+        text = json.dumps(output, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(text + '\n')
+        else:
+            self.stdout.write(text)
+
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def get_meta(self, options):
+        return {
+            'revision': git_revision(),
+            'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'iterations': self.iterations,
+            'cached': options['cached'],
+            'rows': {model._meta.model_name: model.objects.count()
+                     for model in (Person, Publication, Feature, Parameter, Record)},
+        }
+
+    def get_benchmarks(self):
+        # (name, function of the iteration number, whether it writes, items per call)
+        benchmarks = []
+
+        with open(CSL_JSON, encoding='utf-8') as f:
+            entries = json.load(f)[:50]
+        for entry in entries:
+            # new publications (rather than updates of existing ones)
+            entry.pop('DOI', None)
+            entry['title'] += ' (benchmark)'
+        for chunk_size in (5, 25, 50):
+            benchmarks.append((
+                'import_csl_json[chunk_size=%d]' % chunk_size,
+                lambda i, chunk_size=chunk_size: Publication.import_csl_json(entries, chunk_size=chunk_size),
+                True, len(entries)
+            ))
+
+        records = list(Record.objects.order_by('pk').values_list('pk', flat=True)[:10000])
+        records = self.rng.sample(records, min(len(records), self.iterations + self.warmup + 1))
+        benchmarks.append(('Record.save', lambda i: Record.objects.get(pk=records[i % len(records)]).save(), True, 1))
+
+        groups = self.get_similar_people()
+        if groups:
+            benchmarks.append((
+                'Person.combine_people',
+                lambda i: Person.combine_people(Person.objects.filter(pk__in=groups[i % len(groups)])),
+                True, 1
+            ))
+
+        for model_name, search, sort in [('publication', 'lake', '-year'), ('record', 'Lake', 'name'),
+                                         ('person', 'Smith', 'last_name'), ('feature', 'Lake', 'name')]:
+            url = reverse('strativerse:apiv1_list', kwargs={'model_name': model_name})
+            # the last page within the count cap of the API (1000 objects per page)
+            deep_page = max(1, min(apps.get_model('strativerse', model_name).objects.count(), 10000) // 1000)
+            for label, query in [('', ''), ('search', '?q=' + search), ('sort', '?o=' + sort),
+                                 ('search+sort', '?q=%s&o=%s' % (search, sort)),
+                                 ('deep page', '?_p=%d' % deep_page)]:
+                name = 'api %s list' % model_name + (' [%s]' % label if label else '')
+                benchmarks.append((name, self.get_view(url + query), False, 1))
+
+        for model_name, search in [('feature', 'Lake'), ('parameter', 'Lead'), ('person', 'Smith'),
+                                   ('publication', 'lake'), ('record', 'Lake')]:
+            url = reverse('admin:strativerse_%s_changelist' % model_name)
+            benchmarks.append(('admin %s changelist' % model_name, self.get_view(url), False, 1))
+            benchmarks.append(('admin %s changelist [search]' % model_name, self.get_view(url + '?q=' + search),
+                               False, 1))
+
+        return benchmarks
+
+    def get_view(self, url):
+        def get(i):
+            # (the test client closes the response, without closing the database connection)
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            if response.status_code != 200:
+                raise CommandError('GET %s returned %d' % (url, response.status_code))
+        return get
+
+    def get_similar_people(self):
+        # groups of people who are probably the same (same last name and first initial)
+        groups = {}
+        people = Person.objects.order_by('last_name', 'given_names').values_list('pk', 'last_name', 'given_names')
+        for pk, last_name, given_names in people[:20000]:
+            groups.setdefault((last_name, given_names[:1]), []).append(pk)
+        groups = [pks[:3] for pks in groups.values() if len(pks) > 1]
+        self.rng.shuffle(groups)
+        return groups[:self.iterations + self.warmup + 1]
+
+    def call(self, func, i, writes):
+        if not writes:
+            return func(i)
+        try:
+            with transaction.atomic():
+                func(i)
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def run_benchmark(self, name, func, writes, items):
+        for i in range(self.warmup):
+            self.call(func, i, writes)
+
+        durations = []
+        query_counts = []
+        for i in range(self.warmup, self.warmup + self.iterations):
+            queries = QueryCounter()
+            with connection.execute_wrapper(queries):
+                start = time.perf_counter()
+                self.call(func, i, writes)
+                durations.append(time.perf_counter() - start)
+            query_counts.append(queries.count)
+
+        # memory is measured in a separate run, since tracing allocations slows everything down
+        tracemalloc.start()
+        try:
+            self.call(func, self.warmup + self.iterations, writes)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        durations.sort()
+        total = sum(durations)
+        return {
+            'name': name,
+            'iterations': len(durations),
+            'items_per_call': items,
+            'throughput_per_s': len(durations) / total if total else None,
+            'items_per_s': len(durations) * items / total if total else None,
+            'latency_ms': {
+                'mean': total / len(durations) * 1000,
+                'p50': percentile(durations, 0.5) * 1000,
+                'p90': percentile(durations, 0.9) * 1000,
+                'p99': percentile(durations, 0.99) * 1000,
+                'max': durations[-1] * 1000,
+            },
+            'queries': {'mean': sum(query_counts) / len(query_counts), 'max': max(query_counts)},
+            'peak_memory_kb': peak / 1024,
+        }
+
+    def compare(self, path, results):
+        with open(path) as f:
+            previous = {result['name']: result for result in json.load(f)['results']}
+
+        self.stderr.write('%-48s %12s %12s %8s %10s' % ('benchmark', 'p50 before', 'p50 after', 'change', 'queries'))
+        for result in results:
+            before = previous.get(result['name'])
+            if before is None:
+                continue
+            p50_before, p50_after = before['latency_ms']['p50'], result['latency_ms']['p50']
+            change = (p50_after - p50_before) / p50_before * 100 if p50_before else 0
+            self.stderr.write('%-48s %10.2fms %10.2fms %+7.1f%% %4g -> %g' % (
+                result['name'], p50_before, p50_after, change, before['queries']['max'], result['queries']['max']
+            ))
@@ -0,0 +1,390 @@
+
+import datetime
+import itertools
+import json
+import math
+import random
+import time
+import unicodedata
+
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from strativerse.api import cache as api_cache
+from strativerse.models import Alias, Authorship, Feature, Parameter, Person, Publication, Record, \
+    RecordAuthorship, RecordParameter, RecordReference, Tag
+
+# Generates a synthetic (but realistically shaped) dataset for benchmarking: a few prolific
+# authors and many occasional ones, some of whom appear twice under variants of their name (as
+# separate imports would leave them), publications with CSL-like meta tags, a hierarchy of
+# features, and records with geometries, year ranges, parameters, references, and the people who
+# published them (as Record.save() would sync them). The same seed always gives the same data.
+# Rows are written with bulk_create() and explicit primary keys (after any existing rows), so
+# no signals are sent and no reversion versions are saved.
+
+FIRST_NAMES = [
+    'Alice', 'Andrew', 'Anna', 'Benjamin', 'Camille', 'Carlos', 'Chen', 'Daniel', 'David', 'Elena',
+    'Emily', 'Eric', 'Fatima', 'François', 'Hannah', 'Hiroshi', 'Ian', 'Ingrid', 'Jack', 'James',
+    'Jan', 'Jennifer', 'John', 'José', 'Julia', 'Karin', 'Kevin', 'Laura', 'Lei', 'Luca', 'María',
+    'Mark', 'Martin', 'Mei', 'Michael', 'Mohammed', 'Nadia', 'Olivia', 'Paul', 'Peter', 'Priya',
+    'Rachel', 'Richard', 'Robert', 'Sarah', 'Sophie', 'Stefan', 'Thomas', 'Wei', 'Yuki',
+]
+
+LAST_NAMES = [
+    'Anderson', 'Bradley', 'Brown', 'Chen', 'Cohen', 'Cumming', 'Dubois', 'Dunnington', 'Evans',
+    'Fischer', 'García', 'Gregory-Eaves', 'Hall', 'Hansen', 'Ito', 'Jensen', 'Johnson', 'Kim',
+    'Kumar', 'Laird', 'Larsen', 'Lee', 'Li', 'Martin', 'Martínez', 'Meyer', 'Müller', 'Nakamura',
+    'Nguyen', 'Patel', 'Petersen', 'Pienitz', 'Rühland', 'Saulnier-Talbot', 'Smith', 'Smol',
+    'Spooner', 'Taylor', 'Thompson', 'van der Berg', 'Wang', 'Weiss', 'White', 'Williams', 'Wolfe',
+    'Wu', 'Yang', 'Zhang',
+]
+
+TITLE_WORDS = [
+    'lake', 'sediment', 'record', 'Holocene', 'late-glacial', 'climate', 'variability', 'diatom',
+    'chironomid', 'pollen', 'lead', 'mercury', 'deposition', 'atmospheric', 'peat', 'bog', 'core',
+    'isotope', 'geochemistry', 'anthropogenic', 'eutrophication', 'temperature', 'reconstruction',
+    'multi-proxy', 'radiocarbon', 'chronology', 'drought', 'fire', 'vegetation', 'glacier', 'ice',
+    'northern', 'eastern', 'Arctic', 'boreal', 'coastal', 'alpine', 'millennial', 'centennial',
+]
+
+JOURNALS = [
+    'Journal of Paleolimnology', 'Quaternary Science Reviews', 'The Holocene', 'Science of The Total Environment',
+    'Palaeogeography, Palaeoclimatology, Palaeoecology', 'Quaternary Research', 'Boreas',
+    'Environmental Science & Technology', 'Canadian Journal of Earth Sciences', 'Geochimica et Cosmochimica Acta',
+]
+
+PUBLICATION_TYPES = [
+    ('article-journal', 80), ('chapter', 5), ('book', 2), ('report', 4), ('thesis', 5), ('dataset', 2),
+    ('paper-conference', 2),
+]
+
+PARAMETER_NAMES = [
+    'Lead', 'Zinc', 'Copper', 'Mercury', 'Arsenic', 'Titanium', 'Calcium', 'Iron', 'Manganese',
+    'Total organic carbon', 'Loss on ignition', 'Water content', 'Dry bulk density', 'Magnetic susceptibility',
+    'Grain size', 'Biogenic silica', 'Chlorophyll a', 'δ13C', 'δ15N', 'δ18O', 'δD', '210Pb', '137Cs',
+    '14C', 'Diatoms', 'Chironomids', 'Cladocera', 'Pollen', 'Charcoal', 'Testate amoebae',
+]
+
+FEATURE_TYPES = [('water_body', 70), ('bog', 15), ('glacier', 5), ('feature', 10)]
+MEDIA = [('lake_sediment', 60), ('peat', 12), ('marine_sediment', 8), ('glacier_ice', 4), ('speleothem', 3),
+         ('wood', 3), ('coral', 2), ('lake_water', 4), ('other', 4)]
+RECORD_TYPES = [('core', 70), ('samples', 15), ('section', 8), ('sensor', 4), ('other', 3)]
+
+
+def weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights=weights)[0]
+
+
+def initials(given_names):
+    return ' '.join(name[0] for name in given_names.split())
+
+
+def slugify_key(text):
+    # like the slugs made by Publication.update_from_csl_json() (e.g., 'dunnington_etal16')
+    text = text.lower().replace(' ', '').replace('-', '')
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+
+
+def next_id(model):
+    return (model._default_manager.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = 'Generates a synthetic dataset (people, publications, features, parameters, and records) for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--publications', type=int, default=1000)
+        parser.add_argument('--people', type=int, default=None, help='Default: 60%% of the number of publications')
+        parser.add_argument('--records', type=int, default=None, help='Default: the number of publications')
+        parser.add_argument('--features', type=int, default=None, help='Default: a third of the number of records')
+        parser.add_argument('--parameters', type=int, default=len(PARAMETER_NAMES))
+        parser.add_argument('--duplicate-people', type=float, default=0.05,
+                            help='Fraction of people who also appear under a variant of their name')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        n_publications = options['publications']
+        n_people = options['people'] if options['people'] is not None else max(1, int(n_publications * 0.6))
+        n_records = options['records'] if options['records'] is not None else n_publications
+        n_features = options['features'] if options['features'] is not None else max(1, n_records // 3)
+        if min(n_publications, n_people, n_features, options['parameters']) < 1:
+            raise CommandError('There must be at least one publication, person, feature, and parameter')
+
+        self.counts = {}
+        start = time.perf_counter()
+        with transaction.atomic():
+            self.generate_people(n_people, options['duplicate_people'])
+            self.generate_publications(n_publications)
+            self.generate_features(n_features)
+            self.generate_parameters(options['parameters'])
+            self.generate_records(n_records)
+            self.reset_sequences()
+
+        # bulk_create() sends no signals, so cached API responses have to be invalidated here
+        for model in (Person, Publication, Feature, Parameter, Record):
+            api_cache.invalidate_model(model)
+
+        total = sum(self.counts.values())
+        elapsed = time.perf_counter() - start
+        for label, count in self.counts.items():
+            self.stdout.write('%s: %d' % (label, count))
+        self.stdout.write('Wrote %d rows in %.1f s (%.0f rows/s)' % (total, elapsed, total / max(elapsed, 1e-9)))
+
+    def bulk_insert(self, model, objects):
+        # writes objects (from any iterable) in batches, without holding them all in memory
+        objects = iter(objects)
+        while True:
+            batch = list(itertools.islice(objects, self.batch_size))
+            if not batch:
+                break
+            model._default_manager.bulk_create(batch, batch_size=self.batch_size)
+            label = model._meta.label_lower
+            self.counts[label] = self.counts.get(label, 0) + len(batch)
+
+    def generate_people(self, n_people, duplicate_fraction):
+        # each author has a weight (a few are very prolific), and some have a second Person
+        # under a variant of their name (initials only), which is used for some of their work
+        rng = self.rng
+        first_id = next_id(Person)
+        self.authors = []
+        people = []
+        aliases = []
+        used_aliases = set(Alias.objects.values_list('alias', flat=True))
+
+        def add_person(given_names, last_name, suffix):
+            person = Person(id=first_id + len(people), given_names=given_names, last_name=last_name, suffix=suffix)
+            people.append(person)
+            alias = Alias.clean_alias('{}, {} {}'.format(last_name, given_names, suffix))
+            if alias not in used_aliases:
+                used_aliases.add(alias)
+                aliases.append(Alias(person_id=person.id, alias=alias))
+            return person.id
+
+        for i in range(n_people):
+            given_names = rng.choice(FIRST_NAMES)
+            if rng.random() < 0.3:
+                given_names += ' ' + rng.choice(FIRST_NAMES)[0] + '.'
+            last_name = rng.choice(LAST_NAMES)
+            suffix = 'Jr.' if rng.random() < 0.01 else ''
+            ids = [add_person(given_names, last_name, suffix)]
+            if rng.random() < duplicate_fraction:
+                ids.append(add_person(initials(given_names).replace(' ', '. ') + '.', last_name, suffix))
+            self.authors.append((ids, last_name))
+
+        weights = [rng.paretovariate(1.2) for author in self.authors]
+        self.author_cum_weights = list(itertools.accumulate(weights))
+
+        self.bulk_insert(Person, people)
+        self.bulk_insert(Alias, aliases)
+
+    def pick_authors(self, n_authors):
+        picked = []
+        for ids, last_name in self.rng.choices(self.authors, cum_weights=self.author_cum_weights, k=n_authors * 2):
+            person_id = ids[0] if len(ids) == 1 or self.rng.random() < 0.7 else ids[1]
+            if all(person_id != other for other, name in picked):
+                picked.append((person_id, last_name))
+            if len(picked) == n_authors:
+                break
+        return picked
+
+    def generate_publications(self, n_publications):
+        rng = self.rng
+        first_id = next_id(Publication)
+        content_type = ContentType.objects.get_for_model(Publication)
+        used_slugs = set(Publication.objects.values_list('slug', flat=True))
+        # (year, [author person ids]) of each publication, for the records that refer to them
+        self.publications = []
+
+        def publications():
+            for i in range(n_publications):
+                pk = first_id + i
+                year = int(rng.triangular(1960, 2024, 2018))
+                authors = self.pick_authors(min(12, 1 + int(rng.expovariate(0.45))))
+                self.publications.append((pk, year, [person_id for person_id, last_name in authors]))
+
+                names = [slugify_key(last_name) for person_id, last_name in authors]
+                if len(names) == 1:
+                    key = names[0]
+                elif len(names) == 2:
+                    key = names[0] + '_' + names[1]
+                else:
+                    key = names[0] + '_etal'
+                key = key[:48] + '%02d' % (year % 100)
+                slug = next(
+                    (key + suffix for suffix in ('',) + tuple('abcdefghijklmnopqrstuvwxyz') if key + suffix not in used_slugs),
+                    '%s_%d' % (key, pk)
+                )
+                used_slugs.add(slug)
+
+                title = ' '.join(rng.choice(TITLE_WORDS) for word in range(rng.randint(5, 14))).capitalize()
+                yield Publication(
+                    id=pk, slug=slug, type=weighted(rng, PUBLICATION_TYPES), title=title,
+                    DOI='10.%d/synthetic.%d' % (rng.randint(1000, 9999), pk) if rng.random() < 0.85 else '',
+                    abstract=' '.join(rng.choice(TITLE_WORDS) for word in range(rng.randint(0, 120))),
+                    year=year
+                )
+
+        self.bulk_insert(Publication, publications())
+
+        def authorships():
+            for pk, year, person_ids in self.publications:
+                for order, person_id in enumerate(person_ids):
+                    yield Authorship(publication_id=pk, person_id=person_id, role='author', order=order)
+
+        def tags():
+            # the CSL JSON fields that Publication.update_from_csl_json() keeps as meta tags
+            for pk, year, person_ids in self.publications:
+                first_page = rng.randint(1, 900)
+                meta = {
+                    'container-title': rng.choice(JOURNALS),
+                    'volume': str(rng.randint(1, 400)),
+                    'page': '%d-%d' % (first_page, first_page + rng.randint(5, 30)),
+                    'issued': 'application/json:' + json.dumps({'date-parts': [[year]]}),
+                }
+                for key, value in meta.items():
+                    yield Tag(content_type=content_type, object_id=pk, type='meta', key=key, value=value)
+
+        self.bulk_insert(Authorship, authorships())
+        self.bulk_insert(Tag, tags())
+
+    def generate_features(self, n_features):
+        # regions, with water bodies (and the like) in them, some of which have basins or bays
+        rng = self.rng
+        first_id = next_id(Feature)
+        n_regions = max(1, n_features // 25)
+        # (pk, longitude, latitude, name) of the features that records can be in
+        self.features = []
+
+        def features():
+            regions = []
+            for i in range(min(n_regions, n_features)):
+                pk = first_id + i
+                lon, lat = rng.uniform(-140, 40), rng.uniform(35, 75)
+                regions.append((pk, lon, lat, 'Region %d' % (i + 1)))
+                yield Feature(id=pk, name=regions[-1][3], type=rng.choice(['region', 'geopolitical_unit']),
+                              geometry=Point(lon, lat), recursive_depth=0)
+
+            parents = []
+            for i in range(len(regions), n_features):
+                pk = first_id + i
+                if parents and rng.random() < 0.15:
+                    parent_id, lon, lat, parent_name = rng.choice(parents)
+                    name = '%s, %s basin' % (parent_name, rng.choice(['north', 'south', 'east', 'west']))
+                    depth, feature_type = 2, 'feature'
+                else:
+                    parent_id, lon, lat, parent_name = rng.choice(regions)
+                    name = '%s %s' % (rng.choice(['Lake', 'Lac', 'Loch', 'Pond', 'Mire', 'Glacier']),
+                                      ''.join(rng.choice('aeioubcdfghklmnprstvw') for j in range(rng.randint(4, 9))).title())
+                    depth, feature_type = 1, weighted(rng, FEATURE_TYPES)
+                lon, lat = lon + rng.gauss(0, 1.5), max(-89, min(89, lat + rng.gauss(0, 1)))
+                if depth == 1:
+                    parents.append((pk, lon, lat, name))
+                self.features.append((pk, lon, lat, name))
+                yield Feature(id=pk, name=name, type=feature_type, parent_id=parent_id, geometry=Point(lon, lat),
+                              geo_elev=rng.uniform(0, 2500), recursive_depth=depth)
+
+            if not self.features:
+                # (only when there are too few features to have any in the regions)
+                self.features.extend(regions)
+
+        self.bulk_insert(Feature, features())
+
+    def generate_parameters(self, n_parameters):
+        first_id = next_id(Parameter)
+        used_slugs = set(Parameter.objects.values_list('slug', flat=True))
+        parameters = []
+        for i in range(n_parameters):
+            name = PARAMETER_NAMES[i % len(PARAMETER_NAMES)]
+            if i >= len(PARAMETER_NAMES):
+                name += ' (%d)' % (i // len(PARAMETER_NAMES) + 1)
+            slug = 'synthetic/' + slugify_key(name).replace('(', '').replace(')', '').replace(',', '') \
+                .replace('δ', 'd')
+            slug = slug if slug not in used_slugs else '%s-%d' % (slug, first_id + i)
+            used_slugs.add(slug)
+            parameters.append(Parameter(id=first_id + i, name=name, slug=slug))
+        self.parameter_ids = [parameter.id for parameter in parameters]
+        self.bulk_insert(Parameter, parameters)
+
+    def generate_records(self, n_records):
+        rng = self.rng
+        first_id = next_id(Record)
+        content_type = ContentType.objects.get_for_model(Record)
+        # (record pk, [publication indexes], [parameter ids]) for the related rows
+        records = []
+
+        def record_rows():
+            for i in range(n_records):
+                pk = first_id + i
+                feature_id, lon, lat, feature_name = rng.choice(self.features)
+                collected = datetime.date(rng.randint(1975, 2023), rng.randint(1, 12), rng.randint(1, 28))
+                span = math.exp(rng.uniform(math.log(50), math.log(15000)))
+                max_year = collected.year - rng.uniform(0, 5)
+                references = rng.sample(range(len(self.publications)), k=min(len(self.publications),
+                                                                               1 + int(rng.expovariate(1.2))))
+                parameters = rng.sample(self.parameter_ids, k=min(len(self.parameter_ids), rng.randint(1, 6)))
+                records.append((pk, references, parameters))
+                yield Record(
+                    id=pk, name='%s %s-%d' % (feature_name, collected.strftime('%y'), rng.randint(1, 9)),
+                    date_collected=collected, published='published' if rng.random() < 0.8 else 'draft',
+                    feature_id=feature_id, medium=weighted(rng, MEDIA), type=weighted(rng, RECORD_TYPES),
+                    resolution=round(span / rng.randint(20, 400), 1), min_year=round(max_year - span),
+                    max_year=round(max_year), geometry=Point(lon + rng.gauss(0, 0.01), lat + rng.gauss(0, 0.01)),
+                    geo_elev=rng.uniform(0, 2500)
+                )
+
+        self.bulk_insert(Record, record_rows())
+
+        def references():
+            for pk, publication_indexes, parameters in records:
+                for index in publication_indexes:
+                    yield RecordReference(record_id=pk, publication_id=self.publications[index][0],
+                                          type=rng.choice(['contains_data_from', 'refers_to']))
+
+        def record_parameters():
+            for pk, publication_indexes, parameters in records:
+                for parameter_id in parameters:
+                    yield RecordParameter(record_id=pk, parameter_id=parameter_id,
+                                          units=rng.choice(['ppm', 'mg/g', '%', 'per mil', 'counts', '']))
+
+        def record_authorships():
+            # the authors of the referenced publications, oldest publication first (as synced by
+            # Record.save()), plus the people who collected the record
+            for pk, publication_indexes, parameters in records:
+                people = []
+                for index in sorted(publication_indexes, key=lambda index: self.publications[index][1]):
+                    for person_id in self.publications[index][2]:
+                        if person_id not in people:
+                            people.append(person_id)
+                for order, person_id in enumerate(people):
+                    yield RecordAuthorship(record_id=pk, person_id=person_id, role='published', order=20 + order)
+                for order, (person_id, last_name) in enumerate(self.pick_authors(rng.randint(0, 2))):
+                    yield RecordAuthorship(record_id=pk, person_id=person_id, role='collected', order=order)
+
+        def tags():
+            for pk, publication_indexes, parameters in records:
+                if rng.random() < 0.3:
+                    yield Tag(content_type=content_type, object_id=pk, type='tag', key='project',
+                              value='Project %d' % rng.randint(1, 50))
+                if rng.random() < 0.1:
+                    yield Tag(content_type=content_type, object_id=pk, type='tag', key='needs_review', value='')
+
+        self.bulk_insert(RecordReference, references())
+        self.bulk_insert(RecordParameter, record_parameters())
+        self.bulk_insert(RecordAuthorship, record_authorships())
+        self.bulk_insert(Tag, tags())
+
+    def reset_sequences(self):
+        # rows were inserted with explicit primary keys, so sequences (e.g., PostgreSQL's) have
+        # to be moved past them
+        statements = connection.ops.sequence_reset_sql(no_style(), [Person, Publication, Feature, Parameter, Record])
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
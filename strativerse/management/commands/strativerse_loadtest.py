@@ -0,0 +1,378 @@
+
+import http.client
+import json
+import os
+import random
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.urls import reverse
+
+from strativerse.api.v1 import view_lists
+from strativerse.management.utils import percentile
+
+# A load generator for the v1 API: many concurrent clients (threads, each with a keep-alive
+# connection) replay a weighted mix of list, detail, search, sort, and deep page requests for
+# the objects in the database, either against a running server (--url) or against a server that
+# is started for the run (--start-server). Detail requests favour a "hot" set of objects, as real
+# traffic does, so the effect of caching shows up. Throughput, latency percentiles, and errors
+# are reported per kind of request, along with the database connections in use (PostgreSQL
+# only) and the queries per request reported by the server's /metrics (if it has one).
+
+DEFAULT_MIX = 'list=20,detail=40,search=15,sort=10,search_sort=10,page=5'
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in ('list', 'detail', 'search', 'sort', 'search_sort', 'page'):
+            raise CommandError('Unknown kind of request: "%s"' % kind)
+        try:
+            mix[kind] = float(weight)
+        except ValueError:
+            raise CommandError('Invalid weight for "%s": "%s"' % (kind, weight))
+    return mix
+
+
+class RequestMix:
+    # builds the requests to replay from the objects (and words) that are in the database
+
+    def __init__(self, mix, model_names, rng, sample_size=10000):
+        self.kinds, self.weights = zip(*mix.items())
+        self.model_names = model_names
+        self.ids = {}
+        self.terms = {}
+        self.sorts = {}
+        self.pages = {}
+        for model_name in model_names:
+            viewlist_class = view_lists[model_name]
+            model = viewlist_class.model
+            self.ids[model_name] = list(model.objects.order_by('pk').values_list('pk', flat=True)[:sample_size])
+            # hot objects come first
+            rng.shuffle(self.ids[model_name])
+            self.terms[model_name] = self.get_search_terms(viewlist_class, rng)
+            self.sorts[model_name] = [
+                name for name, field in viewlist_class.base_fields.items() if field.is_sortable()
+            ] or ['id']
+            self.pages[model_name] = max(1, min(model.objects.count(), 10000) // 1000)
+
+    @staticmethod
+    def get_search_terms(viewlist_class, rng, n_values=500):
+        for name, field in viewlist_class.base_fields.items():
+            if not field.is_searchable():
+                continue
+            try:
+                viewlist_class.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            values = viewlist_class.model.objects.exclude(**{name: ''}).values_list(name, flat=True)[:n_values]
+            words = sorted({word.strip('.,:;()') for value in values for word in str(value).split() if len(word) > 3})
+            if words:
+                return words
+        return ['a']
+
+    def next_request(self, rng):
+        # (kind, path)
+        kind = rng.choices(self.kinds, weights=self.weights)[0]
+        model_name = rng.choice(self.model_names)
+        if kind == 'detail' and self.ids[model_name]:
+            ids = self.ids[model_name]
+            pk = ids[int(len(ids) * rng.random() ** 3)]
+            return kind, reverse('strativerse:apiv1_detail', kwargs={'model_name': model_name, 'pk': pk})
+
+        path = reverse('strativerse:apiv1_list', kwargs={'model_name': model_name})
+        query = {}
+        if kind in ('search', 'search_sort'):
+            query['q'] = rng.choice(self.terms[model_name])
+        if kind in ('sort', 'search_sort'):
+            query['o'] = rng.choice(['', '-']) + rng.choice(self.sorts[model_name])
+        if kind == 'page':
+            query['_p'] = rng.randint(1, self.pages[model_name])
+        return kind, path + ('?' + urllib.parse.urlencode(query) if query else '')
+
+
+class Worker(threading.Thread):
+
+    def __init__(self, host, port, mix, seed, deadline, timeout, revalidate):
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.mix = mix
+        self.rng = random.Random(seed)
+        self.deadline = deadline
+        self.timeout = timeout
+        self.revalidate = revalidate
+        self.etags = {}
+        # (kind, start time, latency, status, bytes), where status is None for a failed request
+        self.samples = []
+        self.errors = {}
+
+    def run(self):
+        conn = None
+        while time.monotonic() < self.deadline:
+            kind, path = self.mix.next_request(self.rng)
+            headers = {}
+            if self.revalidate and path in self.etags:
+                headers['If-None-Match'] = self.etags[path]
+            start = time.monotonic()
+            try:
+                if conn is None:
+                    conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+                status = response.status
+                if self.revalidate and response.getheader('ETag'):
+                    self.etags[path] = response.getheader('ETag')
+                if response.getheader('Connection', '').lower() == 'close':
+                    conn.close()
+                    conn = None
+            except (OSError, http.client.HTTPException) as e:
+                body, status = b'', None
+                error = type(e).__name__
+                self.errors[error] = self.errors.get(error, 0) + 1
+                if conn is not None:
+                    conn.close()
+                conn = None
+            self.samples.append((kind, start, time.monotonic() - start, status, len(body)))
+        if conn is not None:
+            conn.close()
+
+
+class ConnectionSampler(threading.Thread):
+    # counts the database's connections once a second (PostgreSQL only)
+
+    def __init__(self, interval=1.0):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.counts = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'SELECT COUNT(*), COUNT(*) FILTER (WHERE state = %s) FROM pg_stat_activity '
+                        'WHERE datname = current_database() AND pid <> pg_backend_pid()', ['active']
+                    )
+                    self.counts.append(cursor.fetchone())
+        finally:
+            connections.close_all()
+
+
+def scrape_metrics(host, port, timeout=10):
+    # {(view, model): (requests, queries)} from the API requests in a server's /metrics, or None
+    # (which is only served to some addresses, or with the token in STRATIVERSE_METRICS_TOKEN)
+    token = getattr(settings, 'STRATIVERSE_METRICS_TOKEN', None)
+    headers = {'Authorization': 'Bearer ' + token} if token else {}
+    try:
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        conn.request('GET', '/metrics', headers=headers)
+        response = conn.getresponse()
+        text = response.read().decode('utf-8')
+        conn.close()
+    except (OSError, http.client.HTTPException):
+        return None
+    if response.status != 200:
+        return None
+
+    totals = {}
+    for line in text.splitlines():
+        for suffix, index in (('_count', 0), ('_sum', 1)):
+            prefix = 'strativerse_request_queries' + suffix + '{'
+            if line.startswith(prefix) and 'strativerse:apiv1' in line:
+                labels, value = line[len(prefix):].rsplit('} ', 1)
+                key = tuple(part.split('=', 1)[1].strip('"') for part in labels.split(',')[:2])
+                counts = totals.setdefault(key, [0, 0])
+                counts[index] += float(value)
+    return totals
+
+
+def summarize(samples, duration):
+    latencies = sorted(latency for kind, start, latency, status, size in samples if status is not None)
+    statuses = {}
+    for kind, start, latency, status, size in samples:
+        key = str(status) if status is not None else 'failed'
+        statuses[key] = statuses.get(key, 0) + 1
+    errors = sum(count for status, count in statuses.items() if status == 'failed' or int(status) >= 400)
+    return {
+        'requests': len(samples),
+        'throughput_per_s': len(samples) / duration if duration else None,
+        'error_rate': errors / len(samples) if samples else None,
+        'statuses': statuses,
+        'bytes': sum(size for kind, start, latency, status, size in samples),
+        'latency_ms': {
+            name: percentile(latencies, fraction) * 1000 if latencies else None
+            for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p99.9', 0.999), ('max', 1.0))
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = 'Replays a mix of v1 API requests against a (local) server with many concurrent clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='The server to test')
+        parser.add_argument('--start-server', action='store_true',
+                            help='Start a server on the port in --url for the run (see --server-command)')
+        parser.add_argument('--server-command', default=None,
+                            help='The command that starts the server, with {port} for the port (default: '
+                                 'manage.py runserver --noreload), e.g. "gunicorn strativerse_impl.wsgi '
+                                 '--workers 4 --bind 127.0.0.1:{port}" to size workers')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--duration', type=float, default=30, help='Seconds')
+        parser.add_argument('--ramp-up', type=float, default=5,
+                            help='Seconds over which clients are started (excluded from the results)')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help='Weights of each kind of request')
+        parser.add_argument('--models', default='feature,person,publication,record')
+        parser.add_argument('--revalidate', action='store_true',
+                            help='Send If-None-Match with the ETag from the last response for the same URL')
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', default=None, help='Write results to this file (default: stdout)')
+
+    def handle(self, *args, **options):
+        url = urllib.parse.urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError('--url must be an http:// URL')
+        host, port = url.hostname, url.port or 80
+        model_names = [name.strip() for name in options['models'].split(',') if name.strip()]
+        unknown = [name for name in model_names if name not in view_lists]
+        if unknown:
+            raise CommandError('Unknown model(s): ' + ', '.join(unknown))
+
+        rng = random.Random(options['seed'])
+        mix = RequestMix(parse_mix(options['mix']), model_names, rng)
+        connections.close_all()
+
+        server = self.start_server(options, port) if options['start_server'] else None
+        try:
+            self.wait_for_server(host, port, timeout=60 if server else 5)
+            results = self.run_load(host, port, mix, options)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=30)
+
+        text = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(text + '\n')
+        else:
+            self.stdout.write(text)
+
+        overall = results['overall']
+        self.stderr.write('%d requests, %.1f/s, p50 %.1f ms, p99 %.1f ms, errors %.2f%%' % (
+            overall['requests'], overall['throughput_per_s'] or 0, overall['latency_ms']['p50'] or 0,
+            overall['latency_ms']['p99'] or 0, (overall['error_rate'] or 0) * 100
+        ))
+
+    def start_server(self, options, port):
+        if options['server_command']:
+            command = shlex.split(options['server_command'].format(port=port))
+        else:
+            command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'runserver', '--noreload',
+                       '127.0.0.1:%d' % port]
+        self.stderr.write('Starting %s' % ' '.join(command))
+        return subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def wait_for_server(self, host, port, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                # (any response will do)
+                conn = http.client.HTTPConnection(host, port, timeout=5)
+                conn.request('GET', reverse('strativerse:apiv1_changes'))
+                conn.getresponse().read()
+                conn.close()
+                return
+            except (OSError, http.client.HTTPException):
+                if time.monotonic() > deadline:
+                    raise CommandError('No server is responding at %s:%d' % (host, port))
+                time.sleep(0.5)
+
+    def run_load(self, host, port, mix, options):
+        concurrency = max(1, options['concurrency'])
+        metrics_before = scrape_metrics(host, port)
+        sampler = ConnectionSampler() if connection.vendor == 'postgresql' else None
+        if sampler is not None:
+            sampler.start()
+
+        start = time.monotonic()
+        measured_from = start + options['ramp_up']
+        deadline = measured_from + options['duration']
+        workers = []
+        for i in range(concurrency):
+            worker = Worker(host, port, mix, options['seed'] * 100003 + i, deadline, options['timeout'],
+                            options['revalidate'])
+            worker.start()
+            workers.append(worker)
+            # clients are started evenly over the ramp-up
+            time.sleep(options['ramp_up'] / concurrency)
+        for worker in workers:
+            worker.join(options['timeout'] + 5)
+
+        if sampler is not None:
+            sampler.stopped.set()
+            sampler.join()
+        metrics_after = scrape_metrics(host, port)
+
+        samples = [sample for worker in workers for sample in worker.samples if sample[1] >= measured_from]
+        duration = options['duration']
+        results = {
+            'url': options['url'],
+            'concurrency': concurrency,
+            'duration_s': duration,
+            'mix': dict(zip(mix.kinds, mix.weights)),
+            'revalidate': options['revalidate'],
+            'overall': summarize(samples, duration),
+            'by_kind': {
+                kind: summarize([sample for sample in samples if sample[0] == kind], duration) for kind in mix.kinds
+            },
+            'client_errors': {},
+            'db_connections': None,
+            'queries_per_request': None,
+        }
+
+        for worker in workers:
+            for error, count in worker.errors.items():
+                results['client_errors'][error] = results['client_errors'].get(error, 0) + count
+
+        # requests (and failures) per second, to see whether the server degrades over the run
+        timeline = [{'second': second, 'requests': 0, 'errors': 0} for second in range(int(duration) + 1)]
+        for kind, sample_start, latency, status, size in samples:
+            bucket = timeline[min(int(sample_start - measured_from), len(timeline) - 1)]
+            bucket['requests'] += 1
+            if status is None or status >= 400:
+                bucket['errors'] += 1
+        results['timeline'] = timeline
+
+        if sampler is not None and sampler.counts:
+            totals = [total for total, active in sampler.counts]
+            active = [active for total, active in sampler.counts]
+            results['db_connections'] = {
+                'max': max(totals), 'mean': sum(totals) / len(totals),
+                'max_active': max(active), 'mean_active': sum(active) / len(active),
+            }
+
+        if metrics_before is not None and metrics_after is not None:
+            # (includes the ramp-up)
+            queries = {}
+            for key, (count, total) in metrics_after.items():
+                before_count, before_total = metrics_before.get(key, (0, 0))
+                if count > before_count:
+                    queries['%s %s' % key] = (total - before_total) / (count - before_count)
+            results['queries_per_request'] = queries
+
+        return results
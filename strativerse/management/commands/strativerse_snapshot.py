@@ -0,0 +1,279 @@
+
+import contextlib
+import datetime
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max, Min
+from reversion.models import Revision
+
+# A snapshot is a directory named after the time it was taken, with one gzipped NDJSON file
+# per pk range of every public table and a manifest.json that lists them. If there is an
+# earlier snapshot, a delta directory lists the rows that were added or changed since then
+# ({"op": "upsert", "row": {...}}) and the pks that were removed ({"op": "delete", "pk": ...}).
+# latest.json in the snapshot root names the newest snapshot. Every table is read as of the
+# same moment: with PostgreSQL, from a REPEATABLE READ transaction whose snapshot is exported
+# to the worker processes, and otherwise from a single transaction (and a single worker).
+
+# snapshots are meant to be downloaded by anyone, so only the tables that the API lists, the
+# tables that join them, and their tags are included (never contact details, aliases, or attachments)
+PUBLIC_MODELS = [
+    'strativerse.feature',
+    'strativerse.parameter',
+    'strativerse.person',
+    'strativerse.publication',
+    'strativerse.record',
+]
+SNAPSHOT_MODELS = PUBLIC_MODELS + [
+    'strativerse.authorship',
+    'strativerse.recordauthorship',
+    'strativerse.recordparameter',
+    'strativerse.recordreference',
+    'strativerse.tag',
+]
+
+
+class SnapshotEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        if hasattr(o, 'wkt'):
+            return o.wkt
+        elif isinstance(o, memoryview):
+            return o.hex()
+        return super().default(o)
+
+
+def get_snapshot_root():
+    return getattr(settings, 'STRATIVERSE_SNAPSHOT_ROOT', os.path.join(settings.BASE_DIR, 'snapshots'))
+
+
+def get_snapshot_queryset(model):
+    queryset = model._default_manager.all()
+    if model._meta.label_lower == 'strativerse.tag':
+        # only the tags of public objects
+        content_types = ContentType.objects.get_for_models(*[apps.get_model(label) for label in PUBLIC_MODELS])
+        queryset = queryset.filter(content_type__in=content_types.values())
+    return queryset
+
+
+@contextlib.contextmanager
+def exported_snapshot(using=DEFAULT_DB_ALIAS):
+    # the id of a PostgreSQL snapshot that stays valid until the block exits (or None for other
+    # databases), which is exported from a REPEATABLE READ transaction on a connection of its own
+    wrapper = connections[using]
+    if wrapper.vendor != 'postgresql':
+        yield None
+        return
+    exporter = wrapper.get_new_connection(wrapper.get_connection_params())
+    try:
+        exporter.autocommit = True
+        with exporter.cursor() as cursor:
+            cursor.execute('BEGIN ISOLATION LEVEL REPEATABLE READ')
+            cursor.execute('SELECT pg_export_snapshot()')
+            snapshot_id = cursor.fetchone()[0]
+        yield snapshot_id
+    finally:
+        exporter.close()
+
+
+@contextlib.contextmanager
+def snapshot_transaction(snapshot_id, using=DEFAULT_DB_ALIAS):
+    # a transaction that sees the database as of an exported snapshot (if there is one)
+    with transaction.atomic(using=using):
+        if snapshot_id is not None:
+            with connections[using].cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+                cursor.execute('SET TRANSACTION SNAPSHOT %s', [snapshot_id])
+        yield
+
+
+def iter_rows(model, pk_range=None, chunk_size=2000):
+    # every row of a model as a dict of column values, in pk order, read from a server-side cursor
+    # (where the database supports them)
+    columns = [field.attname for field in model._meta.concrete_fields]
+    queryset = get_snapshot_queryset(model).order_by('pk')
+    if pk_range is not None:
+        queryset = queryset.filter(pk__gte=pk_range[0], pk__lte=pk_range[1])
+    for values in queryset.values_list(*columns).iterator(chunk_size=chunk_size):
+        yield dict(zip(columns, values))
+
+
+def dump_row(row):
+    return json.dumps(row, cls=SnapshotEncoder, sort_keys=True)
+
+
+def write_partition(task):
+    # writes the rows of one model in one pk range, returning its manifest entry
+    label, pk_range, path, chunk_size, snapshot_id = task
+    model = apps.get_model(label)
+    digest = hashlib.sha256()
+    rows = 0
+    with snapshot_transaction(snapshot_id), gzip.open(path, 'wt', encoding='utf-8') as f:
+        for row in iter_rows(model, pk_range, chunk_size):
+            line = dump_row(row) + '\n'
+            f.write(line)
+            digest.update(line.encode('utf-8'))
+            rows += 1
+    return {'file': os.path.basename(path), 'pk_range': pk_range, 'rows': rows, 'sha256': digest.hexdigest()}
+
+
+def write_partition_in_worker(task):
+    # (runs in a worker process, which has a database connection of its own)
+    try:
+        return write_partition(task)
+    finally:
+        connections.close_all()
+
+
+def iter_snapshot_lines(snapshot_dir, table):
+    for partition in table['partitions']:
+        with gzip.open(os.path.join(snapshot_dir, partition['file']), 'rt', encoding='utf-8') as f:
+            yield from f
+
+
+def pk_ranges(model, partitions):
+    # splits the pks of a model into (at most) the given number of inclusive ranges
+    bounds = model._default_manager.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return []
+    low, high = bounds['low'], bounds['high']
+    if not isinstance(low, int):
+        return [(low, high)]
+    size = max(1, (high - low + 1 + partitions - 1) // partitions)
+    return [(start, min(start + size - 1, high)) for start in range(low, high + 1, size)]
+
+
+class Command(BaseCommand):
+    help = 'Writes a compressed snapshot of the public strativerse tables, and a delta from the previous snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help='Snapshot root directory (default: STRATIVERSE_SNAPSHOT_ROOT)')
+        parser.add_argument('--format', default='ndjson', choices=['ndjson'])
+        parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+        parser.add_argument('--partitions', type=int, default=None,
+                            help='Number of pk ranges per table (default: the number of workers)')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--no-delta', action='store_true', help="Don't write a delta from the previous snapshot")
+
+    def handle(self, *args, **options):
+        root = options['output'] or get_snapshot_root()
+        workers = max(1, options['workers'])
+        partitions = max(1, options['partitions'] or workers)
+        if workers > 1 and connections[DEFAULT_DB_ALIAS].vendor != 'postgresql':
+            raise CommandError('More than one worker needs PostgreSQL (so that the workers can share a snapshot)')
+
+        taken = datetime.datetime.now(datetime.timezone.utc)
+        version = taken.strftime('%Y%m%dT%H%M%S%fZ')
+        snapshot_dir = os.path.join(root, version)
+        os.makedirs(snapshot_dir)
+        previous = self.read_manifest(root)
+
+        with exported_snapshot() as snapshot_id:
+            with snapshot_transaction(snapshot_id):
+                # the last revision that the snapshot includes
+                last_revision = Revision.objects.aggregate(last=Max('pk'))['last']
+
+                tasks = []
+                for label in SNAPSHOT_MODELS:
+                    model = apps.get_model(label)
+                    # workers import the exported snapshot, and a single worker reads in this transaction
+                    task_snapshot_id = snapshot_id if workers > 1 else None
+                    for i, pk_range in enumerate(pk_ranges(model, partitions)):
+                        path = os.path.join(snapshot_dir, '%s.%04d.%s.gz' % (label, i, options['format']))
+                        tasks.append((label, pk_range, path, options['chunk_size'], task_snapshot_id))
+                    if not tasks or tasks[-1][0] != label:
+                        # an empty table still gets an (empty) file
+                        path = os.path.join(snapshot_dir, '%s.0000.%s.gz' % (label, options['format']))
+                        tasks.append((label, None, path, options['chunk_size'], task_snapshot_id))
+
+                if workers == 1:
+                    results = [write_partition(task) for task in tasks]
+
+            if workers > 1:
+                # worker processes are forked (so that Django is already set up in them), and can't
+                # share the parent's database connections (the exporting connection is left alone,
+                # and stays open until every worker has imported its snapshot)
+                connections.close_all()
+                with multiprocessing.get_context('fork').Pool(workers) as pool:
+                    results = pool.map(write_partition_in_worker, tasks)
+
+        tables = {}
+        for (label, *_), result in zip(tasks, results):
+            table = tables.setdefault(label, {'rows': 0, 'partitions': []})
+            table['rows'] += result['rows']
+            table['partitions'].append(result)
+
+        manifest = {
+            'version': version,
+            'taken': taken.isoformat(),
+            'format': options['format'],
+            'last_revision': last_revision,
+            'previous_version': previous['version'] if previous else None,
+            'tables': tables
+        }
+
+        if previous and not options['no_delta']:
+            manifest['delta'] = self.write_delta(root, previous, snapshot_dir, manifest)
+
+        with open(os.path.join(snapshot_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        # latest.json is replaced atomically, so that readers never see a partial snapshot
+        latest_tmp = os.path.join(root, 'latest.json.tmp')
+        with open(latest_tmp, 'w') as f:
+            json.dump({'version': version, 'manifest': version + '/manifest.json'}, f)
+        os.replace(latest_tmp, os.path.join(root, 'latest.json'))
+
+        total = sum(table['rows'] for table in tables.values())
+        self.stdout.write('Wrote snapshot %s (%d rows in %d tables) to %s' % (version, total, len(tables), snapshot_dir))
+
+    def read_manifest(self, root):
+        try:
+            with open(os.path.join(root, 'latest.json')) as f:
+                version = json.load(f)['version']
+            with open(os.path.join(root, version, 'manifest.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError) as e:
+            raise CommandError('Could not read the previous snapshot: %s' % e)
+
+    def write_delta(self, root, previous, snapshot_dir, manifest):
+        # compares each table with the previous snapshot, one table at a time
+        previous_dir = os.path.join(root, previous['version'])
+        delta_dir = os.path.join(snapshot_dir, 'delta-from-' + previous['version'])
+        os.makedirs(delta_dir)
+        delta = {'from_version': previous['version'], 'tables': {}}
+
+        for label, table in manifest['tables'].items():
+            pk_name = apps.get_model(label)._meta.pk.attname
+            previous_rows = {}
+            if label in previous['tables']:
+                for line in iter_snapshot_lines(previous_dir, previous['tables'][label]):
+                    previous_rows[json.loads(line)[pk_name]] = hashlib.md5(line.encode('utf-8')).digest()
+
+            upserts = 0
+            path = os.path.join(delta_dir, '%s.%s.gz' % (label, manifest['format']))
+            with gzip.open(path, 'wt', encoding='utf-8') as f:
+                for line in iter_snapshot_lines(snapshot_dir, table):
+                    row = json.loads(line)
+                    if previous_rows.pop(row[pk_name], None) != hashlib.md5(line.encode('utf-8')).digest():
+                        f.write('{"op": "upsert", "row": %s}\n' % line.rstrip('\n'))
+                        upserts += 1
+                for pk in previous_rows:
+                    f.write(json.dumps({'op': 'delete', 'pk': pk}) + '\n')
+
+            delta['tables'][label] = {
+                'file': os.path.relpath(path, snapshot_dir),
+                'upserts': upserts,
+                'deletes': len(previous_rows)
+            }
+
+        return delta
@@ -0,0 +1,12 @@
+
+# helpers shared by the management commands
+
+
+def percentile(sorted_values, fraction):
+    # linear interpolation between the closest ranks
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
@@ -0,0 +1,283 @@
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import hmac
+import re
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+
+# Request metrics in the Prometheus text format, kept in memory by each process (so with
+# several worker processes, each scrape sees the process that served it). Requests are
+# labelled with the name of the URL pattern that matched and the model they are about.
+# Every label has a bounded set of values (anything else is 'other'), so that requests for
+# made-up URLs can't grow the registry. /metrics is only served to staff and to requests with
+# STRATIVERSE_METRICS_TOKEN as a bearer token (and to the addresses in
+# STRATIVERSE_METRICS_ALLOWED_IPS, which is empty by default, since behind a reverse proxy every
+# request comes from the proxy's address).
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_lock = threading.Lock()
+_metrics = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _format_number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with _lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in sorted(self.values.items()):
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        _metrics.append(self)
+
+    def observe(self, value, *label_values):
+        with _lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                # a count per bucket (non-cumulative), the total count, and the sum
+                counts = self.values[label_values] = [0] * len(self.buckets) + [0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self):
+        for label_values, counts in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, [('le', _format_number(bound))])
+                yield self.name + '_bucket', labels, cumulative
+            yield self.name + '_bucket', _format_labels(self.labels, label_values, [('le', '+Inf')]), counts[-2]
+            yield self.name + '_count', _format_labels(self.labels, label_values), counts[-2]
+            yield self.name + '_sum', _format_labels(self.labels, label_values), counts[-1]
+
+
+def render():
+    lines = []
+    with _lock:
+        for metric in _metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type_name))
+            for name, labels, value in metric.samples():
+                lines.append('%s%s %s' % (name, labels, _format_number(value)))
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_LABELS = ('view', 'model', 'method', 'status')
+
+request_duration = Histogram(
+    'strativerse_request_duration_seconds', 'Time spent handling a request (including streamed content)',
+    REQUEST_LABELS
+)
+response_size = Histogram(
+    'strativerse_response_size_bytes', 'Size of response bodies', REQUEST_LABELS, buckets=SIZE_BUCKETS
+)
+request_queries = Histogram(
+    'strativerse_request_queries', 'Number of SQL queries run for a request', REQUEST_LABELS, buckets=COUNT_BUCKETS
+)
+query_duration = Counter(
+    'strativerse_query_duration_seconds_total', 'Time spent running SQL queries', REQUEST_LABELS
+)
+cache_lookups = Counter(
+    'strativerse_cache_lookups_total', 'Cache lookups by cache and result (hit or miss)', ('cache', 'result')
+)
+
+
+def record_cache_lookups(cache_name, hits, misses=0):
+    if hits:
+        cache_lookups.inc(cache_name, 'hit', amount=hits)
+    if misses:
+        cache_lookups.inc(cache_name, 'miss', amount=misses)
+
+
+_admin_url_name = re.compile(r'^[a-z0-9_]+?_([a-z0-9]+)_(changelist|add|change|delete|history)$')
+
+HTTP_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+@functools.lru_cache(maxsize=None)
+def get_model_names():
+    return frozenset(model._meta.model_name for model in apps.get_models())
+
+
+def get_request_labels(request):
+    # (view, model) for a request, from the URL pattern it matched
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched', ''
+    view = match.view_name or match.url_name or ''
+    model = match.kwargs.get('model_name') or match.kwargs.get('model') or ''
+    if not model and match.url_name:
+        admin_match = _admin_url_name.match(match.url_name)
+        if admin_match:
+            model = admin_match.group(1)
+    # model names come from the URL, so anything that isn't a model is lumped together
+    if model and model.lower() not in get_model_names():
+        model = 'other'
+    return view, model
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+# Under ASGI, a request's queries don't run in the thread that runs its middleware (synchronous
+# views run in Django's thread for sync code, and the async API views in a pool of threads), and
+# each thread has connections of its own. So in async mode, middleware adds its execute wrappers
+# to a context variable, which sync_to_async() copies into those threads, and which
+# execute_with_request_wrappers() (installed on every connection) applies.
+_request_wrappers = contextvars.ContextVar('strativerse_request_wrappers', default=())
+
+
+@contextlib.contextmanager
+def request_execute_wrapper(wrapper):
+    token = _request_wrappers.set(_request_wrappers.get() + (wrapper, ))
+    try:
+        yield
+    finally:
+        _request_wrappers.reset(token)
+
+
+def execute_with_request_wrappers(execute, sql, params, many, context):
+    # (the first wrapper is the outermost one, as with connection.execute_wrapper())
+    for wrapper in reversed(_request_wrappers.get()):
+        execute = functools.partial(wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+def install_request_wrappers(sender, connection, **kwargs):
+    # a connection_created receiver
+    if execute_with_request_wrappers not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_with_request_wrappers)
+
+
+class MetricsMiddleware:
+    # should be first in MIDDLEWARE, so that the time spent in other middleware is included
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # so that Django awaits this middleware (as it does MiddlewareMixin)
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        return self.finish(request, response, start, queries)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        queries = QueryCounter()
+        with request_execute_wrapper(queries):
+            response = await self.get_response(request)
+        return self.finish(request, response, start, queries)
+
+    def finish(self, request, response, start, queries):
+        if response.streaming:
+            # streamed content is produced (and queried for) after the view returns
+            content = response.streaming_content
+            response.streaming_content = self.measure_stream(request, response, content, start, queries)
+        else:
+            self.record(request, response, start, queries, len(response.content))
+        return response
+
+    def measure_stream(self, request, response, content, start, queries):
+        size = 0
+        try:
+            with connection.execute_wrapper(queries):
+                for part in content:
+                    size += len(part)
+                    yield part
+        finally:
+            self.record(request, response, start, queries, size)
+
+    def record(self, request, response, start, queries, size):
+        view, model = get_request_labels(request)
+        method = request.method if request.method in HTTP_METHODS else 'other'
+        labels = (view, model, method, str(response.status_code))
+        request_duration.observe(time.perf_counter() - start, *labels)
+        response_size.observe(size, *labels)
+        request_queries.observe(queries.count, *labels)
+        query_duration.inc(*labels, amount=queries.duration)
+
+
+def can_read_metrics(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_staff:
+        return True
+    token = getattr(settings, 'STRATIVERSE_METRICS_TOKEN', None)
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if token and hmac.compare_digest(authorization.encode('utf-8'), ('Bearer ' + token).encode('utf-8')):
+        return True
+    # (only for servers that clients reach directly, see STRATIVERSE_METRICS_ALLOWED_IPS)
+    return request.META.get('REMOTE_ADDR') in getattr(settings, 'STRATIVERSE_METRICS_ALLOWED_IPS', [])
+
+
+def metrics_view(request):
+    if not can_read_metrics(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
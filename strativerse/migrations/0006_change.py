@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+CHANGE_FEED_MODELS = ['feature', 'parameter', 'person', 'publication', 'record']
+
+
+def add_existing_objects(apps, schema_editor):
+    # objects that exist before the change feed does are listed as created, in order of modification
+    Change = apps.get_model('strativerse', 'Change')
+    existing = []
+    for model_name in CHANGE_FEED_MODELS:
+        model = apps.get_model('strativerse', model_name)
+        existing.extend((modified, model_name, pk) for pk, modified in model.objects.values_list('pk', 'modified'))
+    existing.sort()
+    Change.objects.bulk_create(
+        [Change(model_name=model_name, object_id=pk, action='created') for _, model_name, pk in existing],
+        batch_size=2000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('strativerse', '0005_auto_20181231_2309'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=55)),
+                ('object_id', models.IntegerField()),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')], max_length=10)),
+                ('timestamp', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='timestamp')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunPython(add_existing_objects, migrations.RunPython.noop),
+    ]
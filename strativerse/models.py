@@ -12,10 +12,11 @@ from django.core.validators import RegexValidator, ValidationError
 from django.contrib.gis.db.models import GeometryField
 from django.db import models
 from django.utils.html import format_html
-from django.urls import reverse_lazy
 from django.contrib.auth.models import User
 import reversion
 
+from .urltemplates import cached_reverse
+
 
 def duplicate_object(obj, fields=None, relations=None, excluding_fields=(), **kwargs):
     if fields is None:
@@ -109,10 +110,10 @@ class LinkableModel(models.Model):
         abstract = True
 
     def get_admin_url(self):
-        return reverse_lazy('admin:strativerse_{}_change'.format(self._meta.model_name), kwargs={'object_id': self.pk})
+        return cached_reverse('admin:strativerse_{}_change'.format(self._meta.model_name), {'object_id': self.pk})
 
     def get_absolute_url(self):
-        return reverse_lazy('strativerse:detail', kwargs={'model': type(self).__name__.lower(), 'pk': self.pk})
+        return cached_reverse('strativerse:detail', {'pk': self.pk}, fixed_kwargs={'model': type(self).__name__.lower()})
 
     def get_external_url(self):
         return None
@@ -785,3 +786,22 @@ class RecordParameter(models.Model):
 
     def __str__(self):
         return '{} ({})'.format(self.parameter.name, self.units)
+
+
+class Change(models.Model):
+    # the change feed (see api/changes.py): a row for each time an object was created, updated,
+    # or deleted, in the order the changes were written
+    model_name = models.CharField(max_length=55)
+    object_id = models.IntegerField()
+    action = models.CharField(max_length=10, choices=[
+        ('created', 'Created'),
+        ('updated', 'Updated'),
+        ('deleted', 'Deleted')
+    ])
+    timestamp = models.DateTimeField('timestamp', auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return '{} {} {}'.format(self.model_name, self.object_id, self.action)
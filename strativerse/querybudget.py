@@ -0,0 +1,142 @@
+
+import asyncio
+import logging
+import re
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+
+from .metrics import get_request_labels, request_execute_wrapper
+
+logger = logging.getLogger(__name__)
+
+# A query budget is the most SQL queries that a block of code (or a request) should run, and
+# optionally the most times that any one query "shape" (the SQL before parameters are filled in)
+# should be repeated, which is how an N+1 pattern shows up. Going over budget is logged or
+# raised, depending on the action. Request budgets are set per URL name in
+# STRATIVERSE_QUERY_BUDGETS (with 'default' for everything else), e.g.:
+#
+#   STRATIVERSE_QUERY_BUDGETS = {'default': 50, 'strativerse:apiv1_list': (10, 2)}
+#   STRATIVERSE_QUERY_BUDGET_ACTION = 'log'  # or 'raise'
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+_placeholder_list = re.compile(r'\((?:%s, )+%s\)')
+
+
+def query_shape(sql):
+    # (%s, %s, %s) and (%s) are the same shape
+    return _placeholder_list.sub('(%s)', sql)
+
+
+class QueryBudget:
+
+    def __init__(self, max_queries=None, max_repeats=None, name='', action='raise'):
+        if action not in ('log', 'raise'):
+            raise ImproperlyConfigured('Unknown query budget action: "%s"' % action)
+        self.max_queries = max_queries
+        self.max_repeats = max_repeats
+        self.name = name
+        self.action = action
+        self.queries = []
+        self._wrapper = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._wrapper.__exit__(exc_type, exc_value, traceback)
+        self._wrapper = None
+        if exc_type is None:
+            self.check()
+
+    def repeated_queries(self):
+        # {shape: count} for every query shape that was run more than max_repeats times
+        if self.max_repeats is None:
+            return {}
+        counts = {}
+        for sql in self.queries:
+            shape = query_shape(sql)
+            counts[shape] = counts.get(shape, 0) + 1
+        return {shape: count for shape, count in counts.items() if count > self.max_repeats}
+
+    def problems(self):
+        problems = []
+        if self.max_queries is not None and len(self.queries) > self.max_queries:
+            problems.append('%d queries (budget: %d)' % (len(self.queries), self.max_queries))
+        for shape, count in self.repeated_queries().items():
+            problems.append('%d times (budget: %d): %s' % (count, self.max_repeats, shape))
+        return problems
+
+    def check(self):
+        problems = self.problems()
+        if not problems:
+            return
+        message = 'Query budget exceeded by %s:\n%s' % (self.name or 'a block of code', '\n'.join(problems))
+        if self.action == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+def get_request_budget(view_name):
+    # (max queries, max repeats) for a URL name, either of which may be None
+    budgets = getattr(settings, 'STRATIVERSE_QUERY_BUDGETS', {})
+    budget = budgets.get(view_name, budgets.get('default'))
+    if budget is None or isinstance(budget, int):
+        return budget, None
+    return tuple(budget)
+
+
+class QueryBudgetMiddleware:
+    # checks each request against its budget after the response (or its stream) is complete
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # so that Django awaits this middleware (as it does MiddlewareMixin)
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        budget = QueryBudget(action=getattr(settings, 'STRATIVERSE_QUERY_BUDGET_ACTION', 'log'))
+        with connection.execute_wrapper(budget):
+            response = self.get_response(request)
+        return self.finish(request, response, budget)
+
+    async def __acall__(self, request):
+        # (queries run in other threads, see metrics.request_execute_wrapper())
+        budget = QueryBudget(action=getattr(settings, 'STRATIVERSE_QUERY_BUDGET_ACTION', 'log'))
+        with request_execute_wrapper(budget):
+            response = await self.get_response(request)
+        return self.finish(request, response, budget)
+
+    def finish(self, request, response, budget):
+        # the budget depends on the URL that matched, which is only known after the view is resolved
+        view, model = get_request_labels(request)
+        budget.max_queries, budget.max_repeats = get_request_budget(view)
+        budget.name = '%s %s' % (request.method, request.get_full_path())
+
+        if response.streaming:
+            content = response.streaming_content
+            response.streaming_content = self.check_stream(budget, content)
+        else:
+            budget.check()
+        return response
+
+    def check_stream(self, budget, content):
+        with connection.execute_wrapper(budget):
+            yield from content
+        budget.check()
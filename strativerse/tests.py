@@ -1,3 +1,336 @@
-from django.test import TestCase
 
-# Create your tests here.
+import contextlib
+import datetime
+import importlib.util
+import json
+import os
+from unittest import skipUnless
+
+import reversion
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import Point
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from reversion.models import Version
+
+from .api import events as api_events
+from .models import Authorship, Feature, Parameter, Person, Publication, Record, RecordParameter, \
+    RecordReference, duplicate_object
+from .querybudget import QueryBudget, QueryBudgetExceeded, query_shape
+
+# These tests are about how many queries things take rather than what they return: each one
+# runs an API endpoint, an admin changelist, or a model method against the same data, and fails
+# if it runs more queries than its budget, or runs any one query (shape) too many times (which
+# is how an N+1 pattern shows up). When a change legitimately needs more queries, raise the
+# budget in the same commit, so that the reason is recorded next to it.
+
+CSL_JSON = os.path.join(os.path.dirname(__file__), 'static', 'strativerse', 'csl', 'test_csl_json.json')
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-default'},
+    'strativerse_api': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-api'},
+    'strativerse_api_generations': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-api-generations'
+    },
+    'strativerse_rows': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-rows'},
+}
+
+
+def seed_data(n_records=20):
+    # publications (and their authors) from the test CSL JSON, plus features, parameters,
+    # and records that refer to them
+    publications = Publication.import_csl_json(CSL_JSON, chunk_size=50)
+
+    with reversion.create_revision():
+        regions = [Feature.objects.create(name='Region %d' % i, type='region') for i in range(2)]
+        lakes = [
+            Feature.objects.create(name='Lake %d' % i, type='water_body', parent=regions[i % 2],
+                                   geometry=Point(-64 + i, 45 + i))
+            for i in range(6)
+        ]
+        parameters = [
+            Parameter.objects.create(name='Parameter %d' % i, slug='parameter-%d' % i) for i in range(4)
+        ]
+
+        records = []
+        for i in range(n_records):
+            # (Record.save() inserts twice when called with force_insert, as objects.create() does)
+            record = Record(
+                name='Record %d' % i, date_collected=datetime.date(2000 + i % 20, 1, 1),
+                medium='lake_sediment' if i % 3 else 'peat', type='core', feature=lakes[i % len(lakes)],
+                min_year=1000 + i, max_year=2000, geometry=Point(-64 + i / 10, 45 + i / 10)
+            )
+            record.save()
+            for publication in publications[i % 10:i % 10 + 2]:
+                RecordReference.objects.create(record=record, publication=publication, type='contains_data_from')
+            for parameter in parameters[:1 + i % len(parameters)]:
+                RecordParameter.objects.create(record=record, parameter=parameter, units='ppm')
+            record.tags.create(key='batch', value=str(i % 2))
+            # syncs the people who published the record
+            record.save()
+            records.append(record)
+
+    return publications, lakes, parameters, records
+
+
+@override_settings(CACHES=TEST_CACHES)
+class QueryBudgetTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.publications, cls.features, cls.parameters, cls.records = seed_data()
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        for cache in TEST_CACHES:
+            caches[cache].clear()
+
+    @contextlib.contextmanager
+    def assertQueryBudget(self, max_queries, max_repeats=None):
+        try:
+            with QueryBudget(max_queries, max_repeats, name=self.id()) as budget:
+                yield budget
+        except QueryBudgetExceeded as e:
+            self.fail(str(e))
+
+    def get(self, url, max_queries, max_repeats=None, status_code=200):
+        with self.assertQueryBudget(max_queries, max_repeats):
+            response = self.client.get(url)
+            if response.streaming:
+                content = b''.join(response.streaming_content)
+                response.close()
+            else:
+                content = response.content
+        self.assertEqual(response.status_code, status_code, content[:500])
+        return response
+
+
+class APIQueryTestCase(QueryBudgetTestCase):
+    # API responses take a fixed number of queries, however many rows they have, and never
+    # repeat a query
+
+    def test_list(self):
+        # the count (for the validators, which the page reuses) and the rows
+        for model_name in ('feature', 'parameter', 'person', 'publication', 'record'):
+            self.get(reverse('strativerse:apiv1_list', kwargs={'model_name': model_name}), 2, 1)
+
+    def test_list_cached(self):
+        url = reverse('strativerse:apiv1_list', kwargs={'model_name': 'record'})
+        self.get(url, 2, 1)
+        self.get(url, 0)
+
+    def test_list_validators(self):
+        # lists have an ETag (and no Last-Modified), which changes when an older row is deleted
+        url = reverse('strativerse:apiv1_list', kwargs={'model_name': 'record'})
+        response = self.get(url, 2, 1)
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.records[0].delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_list_search_sort_page(self):
+        url = reverse('strativerse:apiv1_list', kwargs={'model_name': 'publication'})
+        self.get(url + '?q=lead&o=-year', 2, 1)
+        self.get(url + '?o=title&_p=2', 2, 1)
+        url = reverse('strativerse:apiv1_list', kwargs={'model_name': 'record'})
+        self.get(url + '?q=Record&o=name&fields=id,name,feature_id', 2, 1)
+
+    def test_list_expand(self):
+        # plus one query per expanded relation
+        url = reverse('strativerse:apiv1_list', kwargs={'model_name': 'record'})
+        self.get(url + '?expand=feature,record_uses.publication', 5, 1)
+
+    def test_list_expand_unknown(self):
+        # only whitelisted relations can be expanded, to a limited depth
+        url = reverse('strativerse:apiv1_list', kwargs={'model_name': 'person'})
+        for expand in ('contact', 'aliases', 'authorships.publication.record_uses'):
+            self.get(url + '?expand=' + expand, 0, status_code=400)
+
+    def test_list_export(self):
+        url = reverse('strativerse:apiv1_list', kwargs={'model_name': 'record'})
+        for export_format in ('csv', 'ndjson'):
+            self.get(url + '?format=' + export_format, 2, 1)
+
+    @skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+    def test_list_export_parquet(self):
+        url = reverse('strativerse:apiv1_list', kwargs={'model_name': 'record'})
+        self.get(url + '?format=parquet', 2, 1)
+
+    def test_detail(self):
+        for model_name, obj in [('feature', self.features[0]), ('parameter', self.parameters[0]),
+                                ('publication', self.publications[0]), ('record', self.records[0])]:
+            self.get(reverse('strativerse:apiv1_detail', kwargs={'model_name': model_name, 'pk': obj.pk}), 2, 1)
+
+    def test_facets(self):
+        # every facet is counted in one query
+        url = reverse('strativerse:apiv1_facets', kwargs={'model_name': 'record'})
+        self.get(url, 1, 1)
+
+    def test_related(self):
+        for model_name, obj, related_model_name in [('feature', self.features[0], 'record'),
+                                                    ('publication', self.publications[0], 'record'),
+                                                    ('record', self.records[0], 'person')]:
+            url = reverse('strativerse:apiv1_related', kwargs={
+                'model_name': model_name, 'pk': obj.pk, 'related_model_name': related_model_name
+            })
+            self.get(url, 2, 1)
+
+    def test_related_batch(self):
+        url = reverse('strativerse:apiv1_related_batch', kwargs={'model_name': 'record', 'related_model_name': 'person'})
+        self.get(url + '?ids=' + ','.join(str(record.pk) for record in self.records), 1, 1)
+
+    def test_bulk(self):
+        url = reverse('strativerse:apiv1_bulk', kwargs={'model_name': 'record'})
+        self.get(url + '?ids=' + ','.join(str(record.pk) for record in self.records), 1, 1)
+
+    @override_settings(STRATIVERSE_CHANGE_FEED_SETTLE_SECONDS=0)
+    def test_changes(self):
+        # the start of the feed, the changes, and the objects of each model that changed
+        self.get(reverse('strativerse:apiv1_changes') + '?since=2000-01-01T00:00:00Z', 7, 1)
+
+    @override_settings(STRATIVERSE_CHANGE_FEED_SETTLE_SECONDS=0)
+    def test_changes_deleted(self):
+        # deletions made inside a revision (as the admin and Person.combine_people() make them) are listed
+        url = reverse('strativerse:apiv1_changes')
+        cursor = json.loads(self.get(url + '?since=2000-01-01T00:00:00Z&limit=1000', 7, 1).content)['cursor']
+        people = list(Person.objects.filter(record_authorships__isnull=False).distinct()[:3])
+        pks = [person.pk for person in people]
+        with reversion.create_revision():
+            Person.combine_people(people)
+        deleted = set(pks).difference(Person.objects.filter(pk__in=pks).values_list('pk', flat=True))
+        feed = json.loads(self.get(url + '?cursor=' + cursor, 7, 1).content)['changes']
+        self.assertEqual(
+            sorted(change['id'] for change in feed if change['model'] == 'person' and change['action'] == 'deleted'),
+            sorted(deleted)
+        )
+
+    def test_events(self):
+        with self.assertQueryBudget(0):
+            response = self.client.get(reverse('strativerse:apiv1_events'))
+            self.assertEqual(next(iter(response.streaming_content)), b'retry: 5000\n\n')
+            response.close()
+
+    def test_events_revision(self):
+        # events name the revision that made the change (which is saved after the change itself)
+        token, events = api_events.subscribe_queue()
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                with reversion.create_revision():
+                    self.records[0].save()
+        finally:
+            api_events.broker.unsubscribe(token)
+        revision = Version.objects.get_for_object(self.records[0]).first().revision_id
+        event = events.get_nowait()
+        self.assertEqual((event['model'], event['id'], event['revision']), ('record', self.records[0].pk, revision))
+
+    @override_settings(STRATIVERSE_EVENTS_MAX_CLIENTS=0)
+    def test_events_max_clients(self):
+        self.get(reverse('strativerse:apiv1_events'), 0, status_code=503)
+
+
+class AdminQueryTestCase(QueryBudgetTestCase):
+    # the list_display methods (e.g., PublicationAdmin.authors()) query once or more for each
+    # row, so changelists have a budget per row on top of a fixed one, and no query may run
+    # more than once per row
+
+    # model name: (fixed queries, queries per row)
+    changelist_budgets = {
+        'feature': (7, 2),
+        'parameter': (7, 2),
+        'person': (9, 4),
+        'publication': (10, 5),
+        'record': (11, 6),
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_changelists(self):
+        for model_name, (fixed, per_row) in self.changelist_budgets.items():
+            with self.subTest(model_name):
+                url = reverse('admin:strativerse_%s_changelist' % model_name)
+                response = self.get(url, None)
+                rows = len(response.context['cl'].result_list)
+                self.assertGreater(rows, 0)
+                self.get(url, fixed + per_row * rows, rows)
+
+
+class ModelQueryTestCase(QueryBudgetTestCase):
+    # importing publications and combining people query once or more for each item (each
+    # author and each field of an entry, each record of a person), so they have a budget per
+    # item on top of a fixed one, and no query may run more often than its share per item
+
+    # (fixed queries, queries per item, repeats per item)
+    import_budget = (10, 94, 14)
+    combine_budget = (3, 26, 2)
+
+    def test_import_csl_json(self):
+        # new publications (without DOIs) that differ only by title and year, so that every entry
+        # costs the same, whose authors already exist
+        with open(CSL_JSON, encoding='utf-8') as f:
+            entry = json.load(f)[0]
+        entry.pop('DOI', None)
+        n = 10
+        entries = [
+            dict(entry, title='%s (%d)' % (entry['title'], i), issued={'date-parts': [[1900 + i]]})
+            for i in range(n)
+        ]
+        fixed, per_entry, repeats = self.import_budget
+        with self.assertQueryBudget(fixed + per_entry * n, repeats * n):
+            items = Publication.import_csl_json(entries, chunk_size=5)
+        self.assertEqual(len(items), n)
+
+    def test_record_save(self):
+        # re-syncs the people who published the record from its references (and logs the change)
+        with self.assertQueryBudget(41, 16):
+            self.records[0].save()
+
+    def test_combine_people(self):
+        # the same person entered n times, each time as the author of a publication that one record uses
+        n = 5
+        people = []
+        for i in range(n):
+            person = Person.objects.create(given_names='Jane', last_name='Doe')
+            publication = Publication.objects.create(title='Duplicate %d' % i, slug='duplicate-%d' % i, year=2000)
+            Authorship.objects.create(publication=publication, person=person, role='author')
+            record = Record(name='Duplicate %d' % i, date_collected=datetime.date(2000, 1, 1), medium='peat',
+                            type='core', feature=self.features[0])
+            record.save()
+            RecordReference.objects.create(record=record, publication=publication, type='contains_data_from')
+            record.save()
+            people.append(person)
+
+        # every person but the one they are combined into is an item
+        fixed, per_person, repeats = self.combine_budget
+        with self.assertQueryBudget(fixed + per_person * (n - 1), 1 + repeats * (n - 1)):
+            Person.combine_people(people)
+
+    def test_duplicate_object(self):
+        with self.assertQueryBudget(66, 16):
+            duplicate_object(self.records[0], name=self.records[0].name + ' (copy)')
+
+
+class QueryBudgetGuardTestCase(QueryBudgetTestCase):
+
+    def test_query_shape(self):
+        self.assertEqual(query_shape('SELECT 1 WHERE id IN (%s, %s, %s)'), 'SELECT 1 WHERE id IN (%s)')
+
+    def test_repeated_queries(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with QueryBudget(max_repeats=2):
+                for record in self.records[:3]:
+                    Authorship.objects.filter(person__record_authorships__record=record).count()
+
+    @override_settings(STRATIVERSE_QUERY_BUDGETS={'strativerse:apiv1_list': 1},
+                       STRATIVERSE_QUERY_BUDGET_ACTION='raise')
+    def test_middleware_raise(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('strativerse:apiv1_list', kwargs={'model_name': 'record'}))
+
+    @override_settings(STRATIVERSE_QUERY_BUDGETS={'default': 0}, STRATIVERSE_QUERY_BUDGET_ACTION='log')
+    def test_middleware_log(self):
+        with self.assertLogs('strativerse.querybudget', 'WARNING'):
+            response = self.client.get(reverse('strativerse:apiv1_list', kwargs={'model_name': 'record'}))
+        self.assertEqual(response.status_code, 200)
@@ -1,20 +1,41 @@
 
+from django.conf import settings
 from django.conf.urls import url
+from django.views.decorators.csrf import csrf_exempt
 from . import views
-from .api.v1 import api
+from .api.v1 import api, async_api
+
+# the async detail, list, and related views are used when serving through ASGI
+# (see strativerse_impl/asgi.py)
+api_views = async_api if getattr(settings, 'STRATIVERSE_API_ASYNC', False) else api
 
 app_name = 'strativerse'
 urlpatterns = [
     # the model redirect view
     url(r'^detail/(?P<model>[a-z0-9]+)/(?P<pk>[0-9]+)$', views.ModelDetailRedirectView.as_view(), name="detail"),
     # APIv1
+    url(r'^api/v1/changes$',
+        api.changes_view,
+        name='apiv1_changes'),
+    url(r'^api/v1/events$',
+        api.events_view,
+        name='apiv1_events'),
     url(r'^api/v1/(?P<model_name>[a-z0-9]+)/(?P<pk>[0-9]+)$',
-        api.detail_view,
+        api_views.detail_view,
         name='apiv1_detail'),
+    url(r'^api/v1/(?P<model_name>[a-z0-9]+)/bulk$',
+        csrf_exempt(api.bulk_view),
+        name='apiv1_bulk'),
+    url(r'^api/v1/(?P<model_name>[a-z0-9]+)/facets$',
+        api.facets_view,
+        name='apiv1_facets'),
     url(r'^api/v1/(?P<model_name>[a-z0-9]+)$',
-        api.list_view,
+        api_views.list_view,
         name='apiv1_list'),
-    url(r'^api/v1/(?P<model_name>[a-z0-9]+)/(?P<related_model_name>[a-z0-9])$',
-        api.related_view,
-        name='apiv1_related')
+    url(r'^api/v1/(?P<model_name>[a-z0-9]+)/(?P<pk>[0-9]+)/(?P<related_model_name>[a-z0-9]+)$',
+        api_views.related_view,
+        name='apiv1_related'),
+    url(r'^api/v1/(?P<model_name>[a-z0-9]+)/(?P<related_model_name>[a-z0-9]+)$',
+        api.related_batch_view,
+        name='apiv1_related_batch')
 ]
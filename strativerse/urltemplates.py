@@ -0,0 +1,78 @@
+
+import re
+
+from django.core.signals import setting_changed
+from django.urls import reverse, get_script_prefix, NoReverseMatch
+
+# reverse() resolves the whole URL pattern every time it is called, which adds up when it
+# is called for every row of a list. Instead, each (view name, keyword arguments) combination
+# is reversed once with numeric placeholders, and integer arguments (e.g., pk) are then
+# formatted straight into the result.
+
+_url_templates = {}
+
+
+def compile_url_template(viewname, int_kwargs, fixed_kwargs=None):
+    placeholders = {name: str(10 ** 15 + i) for i, name in enumerate(int_kwargs)}
+    kwargs = dict(fixed_kwargs or {})
+    kwargs.update(placeholders)
+    try:
+        url = reverse(viewname, kwargs=kwargs)
+    except NoReverseMatch:
+        return None
+
+    # the script prefix is added back when the URL is formatted, since it can change per request
+    prefix = get_script_prefix()
+    if not url.startswith(prefix):
+        return None
+    url = url[len(prefix):]
+
+    names_by_placeholder = {value: name for name, value in placeholders.items()}
+    pattern = re.compile('|'.join(re.escape(value) for value in placeholders.values()))
+    names = [names_by_placeholder[value] for value in pattern.findall(url)]
+    if sorted(names) != sorted(int_kwargs):
+        return None
+
+    return pattern.split(url), names
+
+
+def cached_reverse(viewname, kwargs, fixed_kwargs=None):
+    # like reverse(viewname, kwargs={**fixed_kwargs, **kwargs}), where kwargs are usually integers
+    # (anything else falls back to reverse()) and fixed_kwargs take a small number of values
+    if not all(type(value) is int and value >= 0 for value in kwargs.values()):
+        all_kwargs = dict(fixed_kwargs or {})
+        all_kwargs.update(kwargs)
+        return reverse(viewname, kwargs=all_kwargs)
+
+    key = (viewname, tuple(sorted(kwargs)), tuple(sorted((fixed_kwargs or {}).items())))
+    if key not in _url_templates:
+        _url_templates[key] = compile_url_template(viewname, key[1], fixed_kwargs)
+
+    template = _url_templates[key]
+    if template is None:
+        all_kwargs = dict(fixed_kwargs or {})
+        all_kwargs.update(kwargs)
+        return reverse(viewname, kwargs=all_kwargs)
+
+    pieces, names = template
+    url = [get_script_prefix(), pieces[0]]
+    for name, piece in zip(names, pieces[1:]):
+        url.append(str(kwargs[name]))
+        url.append(piece)
+    return ''.join(url)
+
+
+def clear_url_templates(viewname=None):
+    if viewname is None:
+        _url_templates.clear()
+    else:
+        for key in [key for key in _url_templates if key[0] == viewname]:
+            del _url_templates[key]
+
+
+def _root_urlconf_changed(setting, **kwargs):
+    if setting == 'ROOT_URLCONF':
+        clear_url_templates()
+
+
+setting_changed.connect(_root_urlconf_changed)
@@ -1,17 +1,34 @@
 
+import contextlib
+import csv
+import functools
+import hashlib
+import itertools
 import json
+import logging
+import operator
 import re
+import time
 
 from django import forms
-from django.db.models import F, Q
-from django.core.exceptions import ImproperlyConfigured
+from django.db.models import CharField, Count, Exists, F, OuterRef, Prefetch, Q, QuerySet, Value
+from django.db.models import prefetch_related_objects
+from django.db.models import ForeignObjectRel
+from django.db.models.functions import Cast, Concat
+from django.core.exceptions import ImproperlyConfigured, FieldDoesNotExist
+from django.core.cache import cache
 from django.core.paginator import Paginator, Page, EmptyPage
+from django.db import connection, connections
 from django.utils.functional import cached_property
 from django.template.loader import get_template
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from django.http.request import QueryDict
-from django.urls import reverse_lazy
+
+from . import metrics
+from .urltemplates import cached_reverse
+
+logger = logging.getLogger(__name__)
 
 
 class ViewField(forms.CharField):
@@ -19,12 +36,18 @@ class ViewField(forms.CharField):
     sort_key = None
     view_key = None
     search_key = None
+    column_key = None
+    requires = None
 
     def __init__(self, key=None, sort_key=None, search_key=None,
                  searchable=None, sortable=None, visible=True, filters=None,
-                 null_values=None, **kwargs):
+                 null_values=None, column_key=None, requires=None, **kwargs):
         if key is not None:
             self.key = key
+        if column_key is not None:
+            self.column_key = column_key
+        if requires is not None:
+            self.requires = requires
         if sort_key is not None:
             self.sort_key = sort_key
 
@@ -99,6 +122,29 @@ class ViewField(forms.CharField):
         else:
             return None
 
+    def get_column_key(self):
+        # the column (or '__' lookup) that holds the raw value of this field, if there is one
+        if self.column_key is not None:
+            return self.column_key
+        elif isinstance(self.key, str) and self.key != 'self':
+            return self.key
+        else:
+            return None
+
+    def get_requires(self):
+        # model field lookups needed to compute the value of this field, or None if unknown
+        if self.requires is not None:
+            return list(self.requires)
+        column_key = self.get_column_key()
+        return [column_key] if column_key is not None else None
+
+    def get_related_lookups(self):
+        # lookups that may reach into related objects when the value is computed from an instance
+        lookups = list(self.requires) if self.requires is not None else []
+        if isinstance(self.key, str) and self.key != 'self' and '__' not in self.key:
+            lookups.append(self.key)
+        return lookups
+
     def prepare_queryset(self, queryset):
         if self.key is None:
             raise ImproperlyConfigured('There is no key in this ViewField')
@@ -163,6 +209,12 @@ class UrlPatternViewField(ViewField):
         self.url_pattern = url_pattern
         self.url_kwargs = url_kwargs
 
+    def get_requires(self):
+        requires = super().get_requires()
+        if requires is not None and self.url_kwargs:
+            requires.extend(self.url_kwargs.values())
+        return requires
+
     def prepare_queryset(self, queryset):
         queryset = super().prepare_queryset(queryset)
         if self.url_kwargs:
@@ -177,7 +229,7 @@ class UrlPatternViewField(ViewField):
             if url_kwargs:
                 return format_html(
                     '<a href="{}">{}</a>',
-                    reverse_lazy(self.url_pattern, kwargs=url_kwargs),
+                    cached_reverse(self.url_pattern, url_kwargs),
                     value
                 )
 
@@ -190,6 +242,12 @@ class LinkViewField(ViewField):
         super().__init__(*args, **kwargs)
         self.link_key = link_key
 
+    def get_requires(self):
+        requires = super().get_requires()
+        if requires is not None and self.link_key:
+            requires.append(self.link_key)
+        return requires
+
     def prepare_queryset(self, queryset):
         queryset = super().prepare_queryset(queryset)
         model_fields = [f.name for f in queryset.model._meta.fields]
@@ -211,13 +269,288 @@ class LinkViewField(ViewField):
         return value
 
 
+class _ChunkSink:
+    # a write-only file-like object for pyarrow writers that keeps track of its
+    # own position, so that written bytes can be handed off (and forgotten) per batch
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def pop(self):
+        value = b''.join(self.chunks)
+        self.chunks = []
+        return value
+
+
+def _arrow_column(pa, model_field):
+    # returns the arrow type and a function to convert a list of raw values
+    # from values_list() into something pyarrow understands for that type
+    internal_type = model_field.get_internal_type()
+    if hasattr(model_field, 'geom_type'):
+        return pa.binary(), lambda values: [None if geom is None else bytes(geom.wkb) for geom in values]
+    elif internal_type in ('AutoField', 'BigAutoField', 'SmallAutoField', 'IntegerField', 'BigIntegerField',
+                           'SmallIntegerField', 'PositiveIntegerField', 'PositiveSmallIntegerField',
+                           'PositiveBigIntegerField'):
+        return pa.int64(), None
+    elif internal_type == 'FloatField':
+        return pa.float64(), None
+    elif internal_type in ('BooleanField', 'NullBooleanField'):
+        return pa.bool_(), None
+    elif internal_type == 'DateTimeField':
+        return pa.timestamp('us', tz='UTC'), None
+    elif internal_type == 'DateField':
+        return pa.date32(), None
+    elif internal_type == 'BinaryField':
+        return pa.binary(), None
+    else:
+        return pa.string(), lambda values: [None if value is None else str(value) for value in values]
+
+
+class ViewListPaginator(Paginator):
+    # a Paginator whose count can be exact, cached, estimated by the query planner, or capped
+
+    def __init__(self, object_list, per_page, count_strategy='exact', count_cap=10000,
+                 count_cache_timeout=300, count=None, count_accuracy='exact', **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        if count_strategy not in ('exact', 'cached', 'estimated', 'capped'):
+            raise ImproperlyConfigured('Unknown count strategy: "%s"' % count_strategy)
+        self.count_strategy = count_strategy
+        self.count_cap = count_cap
+        self.count_cache_timeout = count_cache_timeout
+        self.count_accuracy = count_accuracy
+        if count is not None:
+            # already counted (see ViewList.count_rows())
+            self.__dict__['count'] = count
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if self.count_strategy == 'exact' or not isinstance(queryset, QuerySet):
+            return super().count
+        elif self.count_strategy == 'cached':
+            return self.cached_count(queryset)
+        elif self.count_strategy == 'estimated':
+            return self.estimated_count(queryset)
+        else:
+            return self.capped_count(queryset)
+
+    def cached_count(self, queryset):
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except Exception:
+            # e.g., EmptyResultSet
+            return super().count
+
+        key = 'viewlist-count:' + hashlib.md5(repr((queryset.db, sql, params)).encode('utf-8')).hexdigest()
+        count = cache.get(key)
+        metrics.record_cache_lookups('viewlist-count', hits=int(count is not None), misses=int(count is None))
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, self.count_cache_timeout)
+        self.count_accuracy = 'cached'
+        return count
+
+    def estimated_count(self, queryset):
+        # the planner only knows about whole tables, and only postgres exposes it cheaply
+        connection = connections[queryset.db]
+        if queryset.query.where or queryset.query.distinct or connection.vendor != 'postgresql':
+            return super().count
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [connection.ops.quote_name(queryset.model._meta.db_table)]
+            )
+            row = cursor.fetchone()
+
+        # small or never-analyzed tables are cheap (and more accurate) to count
+        if row is None or row[0] < self.count_cap:
+            return super().count
+
+        self.count_accuracy = 'estimated'
+        return row[0]
+
+    def capped_count(self, queryset):
+        count = queryset[:(self.count_cap + 1)].count()
+        if count > self.count_cap:
+            self.count_accuracy = 'capped'
+        return count
+
+    def count_display(self):
+        if self.count_accuracy == 'capped':
+            return '{:,}+'.format(self.count_cap)
+        elif self.count_accuracy == 'estimated':
+            return 'about {:,}'.format(self.count)
+        else:
+            return '{:,}'.format(self.count)
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # pages past an inexact count may well exist
+            if self.count_accuracy == 'exact' or int(number) < 1:
+                raise
+            return int(number)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if self.count_accuracy == 'exact' and top + self.orphans >= self.count:
+            top = self.count
+        return self._get_page(self.object_list[bottom:top], number, self)
+
+
+def _compile_value(get, field, mode):
+    # bakes the null handling and filter of ViewField.value_<mode>() around a getter
+    value_filter = field.filters.get(mode)
+    if mode in field.null_values:
+        null_value = field.null_values[mode]
+        if value_filter is not None:
+            return lambda item: value_filter(get(item) or null_value)
+        else:
+            return lambda item: get(item) or null_value
+    elif value_filter is not None:
+        return lambda item: value_filter(get(item))
+    else:
+        return get
+
+
+def _expression_lookups(expression):
+    # the lookups referred to by a lookup string or an expression built from F() objects
+    if isinstance(expression, str):
+        yield expression
+    elif isinstance(expression, F):
+        yield expression.name
+    else:
+        for source in expression.get_source_expressions():
+            yield from _expression_lookups(source)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_relation(model, name):
+    # the relation that is accessed as model.<name> (e.g., 'authorships' or 'feature'), or None
+    for field in model._meta.get_fields():
+        if not field.is_relation or field.related_model is None:
+            continue
+        accessor = field.get_accessor_name() if isinstance(field, ForeignObjectRel) else field.name
+        if accessor == name:
+            return field
+    return None
+
+
+class _EchoBuffer:
+    # a file-like object that hands back whatever csv.writer writes to it,
+    # so that rows can be streamed without buffering the whole table
+
+    def write(self, value):
+        return value
+
+
+class ViewListProfile:
+    # time and SQL queries spent in each stage of a ViewList (sort, filter, finalize, count,
+    # paginate, rows, serialize) and in each field's value_<mode>() while rendering rows
+
+    def __init__(self, name=''):
+        self.name = name
+        self.queries = metrics.QueryCounter()
+        self.stages = {}
+        self.fields = {}
+        self._depth = 0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        queries = self.queries.count
+        self._depth += 1
+        try:
+            if self._depth == 1:
+                with connection.execute_wrapper(self.queries):
+                    yield
+            else:
+                yield
+        finally:
+            self._depth -= 1
+            stats = self.stages.setdefault(name, [0.0, 0])
+            stats[0] += time.perf_counter() - start
+            stats[1] += self.queries.count - queries
+
+    def timed_getter(self, name, get):
+        # wraps a row value getter, adding its time and queries to the field's totals
+        stats = self.fields.setdefault(name, [0.0, 0, 0])
+
+        def timed(item):
+            start = time.perf_counter()
+            queries = self.queries.count
+            try:
+                return get(item)
+            finally:
+                stats[0] += time.perf_counter() - start
+                stats[1] += self.queries.count - queries
+                stats[2] += 1
+
+        return timed
+
+    def as_dict(self):
+        return {
+            'stages': {name: {'ms': seconds * 1000, 'queries': queries}
+                       for name, (seconds, queries) in self.stages.items()},
+            'fields': {name: {'ms': seconds * 1000, 'queries': queries, 'calls': calls}
+                       for name, (seconds, queries, calls) in self.fields.items()}
+        }
+
+    def server_timing(self):
+        # the value of a Server-Timing header, which browser developer tools show as a breakdown
+        entries = []
+        for name, (seconds, queries) in self.stages.items():
+            entries.append('%s;dur=%.3f;desc="%d queries"' % (name, seconds * 1000, queries))
+        for name, (seconds, queries, calls) in self.fields.items():
+            entries.append('field-%s;dur=%.3f;desc="%d queries, %d rows"' % (name, seconds * 1000, queries, calls))
+        return ', '.join(entries)
+
+    def log(self):
+        logger.info('Profile of %s: %s', self.name, json.dumps(self.as_dict()))
+
+
 class ViewList(forms.Form):
     model = None
     search_form_class = None
     order_var = '_o'
     page_var = '_p'
     search_var = '_q'
+    fields_var = '_f'
+    facets_var = '_facets'
+    expand_var = None
+    expandable = None
+    expand_depth = 2
+    facets = None
     paginate_by = None
+    count_strategy = 'exact'
+    count_cap = 10000
+    count_cache_timeout = 300
+    row_cache_field = None
+    row_cache_timeout = 3600
+    export_chunk_size = 2000
+    profile = None
     template_name = 'viewlist/viewlist_table.html'
 
     class Media:
@@ -230,6 +563,7 @@ class ViewList(forms.Form):
         super().__init__(prefix=self.prefix)
 
         self.data = data
+        self.row_count = None
 
         for name, field in self.fields.items():
             if not isinstance(field, ViewField):
@@ -249,6 +583,14 @@ class ViewList(forms.Form):
 
         self.search_form.fields[self.order_var] = forms.CharField(required=False, widget=forms.HiddenInput)
 
+    def enable_profiling(self):
+        # opt-in: records where the time goes (see ViewListProfile) until the profile is read
+        self.profile = ViewListProfile(type(self).__qualname__)
+        return self.profile
+
+    def profile_stage(self, name):
+        return self.profile.stage(name) if self.profile is not None else contextlib.nullcontext()
+
     def is_searchable(self):
         return any(field.is_searchable() for field in self.fields.values())
 
@@ -258,6 +600,29 @@ class ViewList(forms.Form):
     def get_paginate_by(self):
         return self.paginate_by
 
+    def get_count_strategy(self):
+        return self.count_strategy
+
+    def count_rows(self):
+        # (count, accuracy) for the rows that match the search and filters, counted as the
+        # paginator counts them (see get_count_strategy()), which paginate() then reuses
+        if self.row_count is None:
+            paginator = self.make_paginator(self.filter_queryset(self.get_queryset()), self.get_paginate_by() or 1)
+            self.row_count = (paginator.count, paginator.count_accuracy)
+        return self.row_count
+
+    def make_paginator(self, queryset, per_page):
+        counted = {}
+        if self.row_count is not None:
+            counted = {'count': self.row_count[0], 'count_accuracy': self.row_count[1]}
+        return ViewListPaginator(
+            queryset, per_page,
+            count_strategy=self.get_count_strategy(),
+            count_cap=self.count_cap,
+            count_cache_timeout=self.count_cache_timeout,
+            **counted
+        )
+
     def form_action(self):
         return self.get_query_string()
 
@@ -292,6 +657,77 @@ class ViewList(forms.Form):
             raise ImproperlyConfigured('self.model is not defined for this ViewList')
         return self.model.objects.all()
 
+    def split_multivalued_lookup(self, lookup):
+        # splits a lookup like 'authorships__person__last_name__icontains' at its first multi-valued
+        # relation into (path to it, relation field, rest of the lookup), or returns None
+        model = self.model
+        parts = lookup.split('__')
+        for i, part in enumerate(parts):
+            try:
+                field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                return None
+            if not field.is_relation or field.related_model is None:
+                return None
+            if field.many_to_many or field.one_to_many:
+                inner = parts[i + 1:]
+                # a lookup on the relation itself (e.g., 'records__in') is a lookup on its primary key
+                try:
+                    field.related_model._meta.get_field(inner[0])
+                except (IndexError, FieldDoesNotExist):
+                    inner = ['pk'] + inner
+                return parts[:i], field, '__'.join(inner)
+            model = field.related_model
+        return None
+
+    def exists_expression(self, lookup, value):
+        # a correlated EXISTS() for a lookup that spans a multi-valued relation, which (unlike a
+        # join) can't multiply rows, or None if the lookup can't be written that way
+        split = self.split_multivalued_lookup(lookup)
+        if split is None:
+            return None
+        path, field, inner_lookup = split
+        if isinstance(field, ForeignObjectRel):
+            outer_name = field.field.name
+        elif field.many_to_many and field.concrete:
+            outer_name = field.related_query_name()
+        else:
+            # e.g., generic relations
+            return None
+
+        subquery = field.related_model._default_manager.filter(**{
+            outer_name: OuterRef('__'.join(path + ['pk'])),
+            inner_lookup: value
+        })
+        return Exists(subquery.order_by().values('pk'))
+
+    def compile_search_expression(self, expression):
+        # rewrites the parts of a Q() that span multi-valued relations as EXISTS() subqueries,
+        # returning (expression, whether the result still needs .distinct())
+        if not isinstance(expression, Q):
+            return expression, True
+
+        compiled = Q()
+        compiled.connector = expression.connector
+        compiled.negated = expression.negated
+        needs_distinct = False
+        for child in expression.children:
+            if isinstance(child, Q):
+                child, child_distinct = self.compile_search_expression(child)
+            elif isinstance(child, tuple):
+                lookup, value = child
+                if self.split_multivalued_lookup(lookup) is None:
+                    child_distinct = False
+                else:
+                    exists = self.exists_expression(lookup, value)
+                    child, child_distinct = (child, True) if exists is None else (exists, False)
+            else:
+                child_distinct = True
+            compiled.children.append(child)
+            needs_distinct = needs_distinct or child_distinct
+
+        return compiled, needs_distinct
+
     def filter_queryset(self, queryset):
         if self.search_form._errors is None:
             self.search_form.full_clean()
@@ -311,11 +747,13 @@ class ViewList(forms.Form):
                 else:
                     expression = expression | expr
 
-        if expression is not None:
-            return queryset.filter(expression).distinct()
-        else:
+        if expression is None:
             return queryset
 
+        expression, needs_distinct = self.compile_search_expression(expression)
+        queryset = queryset.filter(expression)
+        return queryset.distinct() if needs_distinct else queryset
+
     def sort_queryset(self, queryset):
         if self.search_form._errors is None:
             self.search_form.full_clean()
@@ -336,10 +774,234 @@ class ViewList(forms.Form):
                 break
         return queryset
 
+    def get_requested_field_names(self):
+        # field names requested in the query string (e.g., ?_f=id,name), or None for all of them
+        if not self.data or self.fields_var is None:
+            return None
+        prefix = self.prefix + '-' if self.prefix else ''
+        value = self.data.get(prefix + self.fields_var, '')
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        return names if names else None
+
+    def get_unknown_field_names(self):
+        names = self.get_requested_field_names()
+        if names is None:
+            return []
+        return [name for name in names if name not in self.fields]
+
+    def get_expand_paths(self):
+        # relation paths requested in the query string (e.g., ?expand=authorships.person), as lists
+        if not self.data or self.expand_var is None:
+            return []
+        prefix = self.prefix + '-' if self.prefix else ''
+        value = self.data.get(prefix + self.expand_var, '')
+        return [path.strip().split('.') for path in value.split(',') if path.strip()]
+
+    def get_expandable(self):
+        # {relation name: ViewList class} for the relations that ?expand= may inline
+        return self.expandable or {}
+
+    def make_expansion_viewlist(self, viewlist_class):
+        # the ViewList that renders the expanded objects of a relation
+        return viewlist_class(data=None)
+
+    @cached_property
+    def _expansion_tree(self):
+        # (tree, unknown paths), where the tree is {relation name: (ViewList, {...})} for the
+        # requested paths that are expandable and no deeper than expand_depth
+        tree = {}
+        unknown = []
+        for path in self.get_expand_paths():
+            if len(path) > self.expand_depth:
+                unknown.append('.'.join(path))
+                continue
+            viewlist, node = self, tree
+            for name in path:
+                viewlist_class = viewlist.get_expandable().get(name)
+                if viewlist_class is None:
+                    unknown.append('.'.join(path))
+                    break
+                if name not in node:
+                    node[name] = (viewlist.make_expansion_viewlist(viewlist_class), {})
+                viewlist, node = node[name]
+        return tree, unknown
+
+    def get_unknown_expand_paths(self):
+        return self._expansion_tree[1]
+
+    @property
+    def expansions(self):
+        # the requested expansions as a tree of {relation name: (ViewList, {...})}
+        tree, unknown = self._expansion_tree
+        return {} if unknown else tree
+
+    def expansion_prefetches(self, tree):
+        # a Prefetch() per expanded relation, so that each relation is loaded in one query
+        # no matter how many objects are rendered
+        prefetches = []
+        for name, (viewlist, subtree) in tree.items():
+            queryset = viewlist.finalize_queryset(viewlist.get_queryset())
+            nested = self.expansion_prefetches(subtree)
+            if nested:
+                queryset = queryset.prefetch_related(*nested)
+            prefetches.append(Prefetch(name, queryset=queryset))
+        return prefetches
+
+    def expand_row(self, item, row, tree):
+        # adds the expanded relations of item to its (JSON) row
+        for name, (viewlist, subtree) in tree.items():
+            field = _get_relation(type(item), name)
+            if field.many_to_many or field.one_to_many:
+                row[name] = [self.expanded_row(viewlist, obj, subtree) for obj in getattr(item, name).all()]
+            else:
+                obj = getattr(item, name, None)
+                row[name] = self.expanded_row(viewlist, obj, subtree) if obj is not None else None
+        return row
+
+    def expanded_row(self, viewlist, obj, tree):
+        # related objects are rendered with the fields of their own ViewList
+        return self.expand_row(obj, viewlist.row_json(obj), tree)
+
+    @cached_property
+    def output_fields(self):
+        names = self.get_requested_field_names()
+        if names is None:
+            return [field for field in self.fields.values() if field.visible]
+        else:
+            return [self.fields[name] for name in names if name in self.fields and self.fields[name].visible]
+
+    def project_queryset(self, queryset):
+        # when only some fields were requested, only load the columns those fields need
+        if self.get_requested_field_names() is None:
+            return queryset
+
+        only = {self.model._meta.pk.name}
+        for field in self.output_fields:
+            requires = field.get_requires()
+            if requires is None:
+                # can't tell what a callable needs, so everything has to be loaded
+                return queryset
+            for lookup in requires:
+                if lookup == 'pk':
+                    continue
+                if self.get_model_field(lookup) is None:
+                    return queryset
+                only.add(lookup.split('__')[0])
+
+        if self.uses_row_cache():
+            only.add(self.row_cache_field)
+        for name in self.expansions:
+            # expanding a foreign key needs its column
+            field = _get_relation(self.model, name)
+            if field.concrete and (field.many_to_one or field.one_to_one):
+                only.add(name)
+
+        return queryset.only(*only)
+
+    def get_relation_path(self, lookup):
+        # the related-object part of a lookup (e.g., 'feature' for 'feature__name') and
+        # whether it has to be prefetched (rather than joined with select_related())
+        model = self.model
+        path = []
+        prefetch = False
+        for part in lookup.split('__'):
+            if model is None:
+                break
+            try:
+                field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                break
+            if not field.is_relation or (part == getattr(field, 'attname', None) and part != field.name):
+                break
+            if not (field.many_to_one or field.one_to_one) or field.related_model is None:
+                prefetch = True
+            path.append(part)
+            model = field.related_model
+
+        return '__'.join(path), prefetch
+
+    def get_dependency_lookups(self):
+        # lookups through which searching, sorting, or rendering a field reaches other models
+        lookups = []
+        for field in self.fields.values():
+            for key in (field.key, field.sort_key, field.search_key):
+                if isinstance(key, str) and key != 'self':
+                    lookups.append(key)
+            lookups.extend(field.get_related_lookups())
+        for facet in self.get_facets().values():
+            lookups.extend(_expression_lookups(facet))
+        for path in self.get_expand_paths():
+            lookups.append('__'.join(path))
+        return lookups
+
+    def get_dependent_models(self):
+        # every model whose rows can change the output of this ViewList
+        models = {self.model}
+        for lookup in self.get_dependency_lookups():
+            model = self.model
+            for part in lookup.split('__'):
+                try:
+                    field = model._meta.get_field(part)
+                except FieldDoesNotExist:
+                    break
+                if not field.is_relation or field.related_model is None:
+                    break
+                model = field.related_model
+                models.add(model)
+
+        # expanded objects are rendered by their own ViewLists, whose fields may use other models
+        stack = list(self.expansions.values())
+        while stack:
+            viewlist, subtree = stack.pop()
+            models |= viewlist.get_dependent_models()
+            stack.extend(subtree.values())
+
+        return models
+
+    def relate_queryset(self, queryset):
+        # join or prefetch the related objects that the output fields need, so that
+        # rendering rows never triggers a query per row
+        select_related = []
+        prefetch_related = []
+        for field in self.output_fields:
+            for lookup in field.get_related_lookups():
+                path, prefetch = self.get_relation_path(lookup)
+                if not path:
+                    continue
+                elif prefetch and path not in prefetch_related:
+                    prefetch_related.append(path)
+                elif not prefetch and path not in select_related:
+                    select_related.append(path)
+
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        if self.expansions:
+            queryset = queryset.prefetch_related(*self.expansion_prefetches(self.expansions))
+        return queryset
+
     def finalize_queryset(self, queryset):
         for field in self.fields.values():
             queryset = field.prepare_queryset(queryset)
-        return queryset
+        queryset = self.relate_queryset(queryset)
+        return self.project_queryset(queryset)
+
+    def iter_queryset(self, queryset):
+        # iterates in chunks from a server-side cursor where the database supports it,
+        # running prefetch_related() lookups one chunk at a time (QuerySet.iterator() skips them)
+        iterator = queryset.iterator(chunk_size=self.export_chunk_size)
+        lookups = queryset._prefetch_related_lookups
+        if not lookups:
+            yield from iterator
+            return
+
+        while True:
+            chunk = list(itertools.islice(iterator, self.export_chunk_size))
+            if not chunk:
+                break
+            prefetch_related_objects(chunk, *lookups)
+            yield from chunk
 
     def paginate(self, queryset):
         paginate_by = self.get_paginate_by()
@@ -352,19 +1014,30 @@ class ViewList(forms.Form):
                 except ValueError:
                     page_num = 1
 
+            paginator = self.make_paginator(queryset, paginate_by)
             try:
-                return Paginator(queryset, paginate_by).page(page_num)
+                if self.profile is not None:
+                    with self.profile_stage('count'):
+                        paginator.count
+                with self.profile_stage('paginate'):
+                    return paginator.page(page_num)
             except EmptyPage:
                 return queryset.none()
         else:
             return queryset
 
-    def assemble_queryset(self):
+    def assemble_queryset(self, paginate=True):
         queryset = self.get_queryset()
-        queryset = self.sort_queryset(queryset)
-        queryset = self.filter_queryset(queryset)
-        queryset = self.finalize_queryset(queryset)
-        return self.paginate(queryset)
+        with self.profile_stage('sort'):
+            queryset = self.sort_queryset(queryset)
+        with self.profile_stage('filter'):
+            queryset = self.filter_queryset(queryset)
+        with self.profile_stage('finalize'):
+            queryset = self.finalize_queryset(queryset)
+        if paginate:
+            return self.paginate(queryset)
+        else:
+            return queryset
 
     @cached_property
     def object_list(self):
@@ -375,29 +1048,351 @@ class ViewList(forms.Form):
         ol = self.object_list
         return {'viewlist': self}
 
-    def rowiter_text(self):
-        for item in self.object_list:
-            yield self.row_text(item)
+    def get_value_column(self, field, mode):
+        # the values_list() lookup that gives exactly the value of field.value_<mode>(item)
+        # (before null handling and filters), or None if the value needs a model instance
+        key = field.key
+        if not isinstance(key, str) or key == 'self' or self.model is None:
+            return None
+        if type(field).value_base is not ViewField.value_base:
+            return None
+        if getattr(type(field), 'value_' + mode) is not getattr(ViewField, 'value_' + mode):
+            return None
+
+        if '__' in key:
+            # these are annotated with F() in prepare_queryset()
+            return key if self.get_model_field(key) is not None else None
+
+        try:
+            model_field = self.model._meta.get_field(key)
+        except FieldDoesNotExist:
+            return None
+        if not model_field.concrete or (model_field.is_relation and key != model_field.attname):
+            return None
+        return key
+
+    def get_row_plan(self, mode):
+        # the (name, column) of each output field, worked out once per class and field selection
+        plans = type(self).__dict__.get('_row_plans')
+        if plans is None:
+            plans = {}
+            type(self)._row_plans = plans
+
+        plan_key = (mode, tuple(field.name for field in self.output_fields))
+        if plan_key not in plans:
+            plans[plan_key] = [(field.name, self.get_value_column(field, mode)) for field in self.output_fields]
+        return plans[plan_key]
+
+    def compile_row(self, mode, from_values=False):
+        # returns the values_list() lookups and a function that renders one row, either from
+        # a values_list() tuple (if every field is a column) or from a model instance
+        lookups = []
+        getters = []
+        names = []
+        for name, column in self.get_row_plan(mode):
+            field = self.fields[name]
+            names.append(name)
+            if from_values:
+                if column is None:
+                    raise ImproperlyConfigured('Field "%s" cannot be rendered from values_list()' % name)
+                if column not in lookups:
+                    lookups.append(column)
+                getters.append(_compile_value(operator.itemgetter(lookups.index(column)), field, mode))
+            elif column is not None:
+                getters.append(_compile_value(operator.attrgetter(column), field, mode))
+            else:
+                getters.append(getattr(field, 'value_' + mode))
+            if self.profile is not None:
+                getters[-1] = self.profile.timed_getter(name, getters[-1])
+
+        if mode == 'json':
+            def make_row(item):
+                return dict(zip(names, [get(item) for get in getters]))
+        else:
+            def make_row(item):
+                return [get(item) for get in getters]
+
+        return lookups, make_row
+
+    def _rowiter_compiled(self, object_list, mode):
+        if object_list is None:
+            object_list = self.object_list
 
-    def rowiter_html(self):
-        for item in self.object_list:
+        with self.profile_stage('rows'):
+            queryset = object_list.object_list if isinstance(object_list, Page) else object_list
+            unevaluated = isinstance(queryset, QuerySet) and queryset._result_cache is None
+
+            expansions = self.expansions if mode == 'json' else None
+            if unevaluated and not expansions and all(column is not None for name, column in self.get_row_plan(mode)):
+                lookups, make_row = self.compile_row(mode, from_values=True)
+                items = queryset.values_list(*lookups).iterator(chunk_size=self.export_chunk_size)
+            else:
+                lookups, make_row = self.compile_row(mode, from_values=False)
+                items = self.iter_queryset(queryset) if unevaluated else object_list
+
+            if expansions:
+                make_field_row = make_row
+
+                def make_row(item):
+                    return self.expand_row(item, make_field_row(item), expansions)
+
+            if mode == 'json' and isinstance(object_list, Page) and not lookups and self.uses_row_cache():
+                yield from self._rowiter_cached(items, make_row, mode)
+            else:
+                for item in items:
+                    yield make_row(item)
+
+    def get_row_cache(self):
+        # a Django cache for rendered rows, or None to render every row every time
+        return None
+
+    def uses_row_cache(self):
+        # a cached row is identified by the object's row_cache_field (e.g., a modified timestamp),
+        # which says nothing about related objects, so fields that use them can't be cached
+        if self.row_cache_field is None or self.get_row_cache() is None or self.expansions:
+            return False
+        for field in self.output_fields:
+            for lookup in field.get_related_lookups():
+                if self.get_relation_path(lookup)[0]:
+                    return False
+        return True
+
+    @cached_property
+    def _row_cache_digest(self):
+        names = tuple(field.name for field in self.output_fields)
+        return hashlib.md5(repr((type(self).__qualname__, names)).encode('utf-8')).hexdigest()
+
+    def get_row_cache_key(self, item, mode):
+        version = getattr(item, self.row_cache_field)
+        if hasattr(version, 'isoformat'):
+            version = version.isoformat()
+        return 'viewlist-row:%s:%s:%s:%s:%s' % (
+            self.model._meta.label_lower, item.pk, version, mode, self._row_cache_digest
+        )
+
+    def _rowiter_cached(self, items, make_row, mode):
+        # rows are looked up with one get_many() per chunk, and only rows
+        # that are missing from the cache are rendered
+        row_cache = self.get_row_cache()
+        items = iter(items)
+        while True:
+            chunk = list(itertools.islice(items, self.export_chunk_size))
+            if not chunk:
+                break
+
+            keys = [self.get_row_cache_key(item, mode) for item in chunk]
+            cached = row_cache.get_many(keys)
+            metrics.record_cache_lookups('viewlist-row', hits=len(cached), misses=len(keys) - len(cached))
+            missing = {}
+            for key, item in zip(keys, chunk):
+                if key in cached:
+                    yield cached[key]
+                else:
+                    row = make_row(item)
+                    missing[key] = row
+                    yield row
+
+            if missing:
+                row_cache.set_many(missing, self.row_cache_timeout)
+
+    def rowiter_text(self, object_list=None):
+        return self._rowiter_compiled(object_list, 'text')
+
+    def rowiter_html(self, object_list=None):
+        if object_list is None:
+            object_list = self.object_list
+        for item in object_list:
             yield self.row_html(item)
 
-    def rowiter_json(self):
-        for item in self.object_list:
-            yield self.row_json(item)
+    def rowiter_json(self, object_list=None):
+        return self._rowiter_compiled(object_list, 'json')
+
+    def rowiter_delimited(self, object_list=None, delimiter=','):
+        writer = csv.writer(_EchoBuffer(), delimiter=delimiter)
+        yield writer.writerow(self.header_text())
+        for row in self.rowiter_text(object_list):
+            yield writer.writerow(row)
+
+    def rowiter_ndjson(self, object_list=None):
+        for row in self.rowiter_json(object_list):
+            yield json.dumps(row) + '\n'
+
+    def get_model_field(self, lookup, multiple=False):
+        # resolves a column key like 'feature__name' to a single-valued model field, or None
+        # (with multiple=True, lookups that span a multi-valued relation are resolved too)
+        model = self.model
+        field = None
+        for part in lookup.split('__'):
+            if model is None:
+                return None
+            try:
+                field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                return None
+            if field.is_relation and not (multiple or field.many_to_one or field.one_to_one):
+                return None
+            model = field.related_model if field.is_relation else None
+
+        if field is not None and field.is_relation:
+            # foreign keys are exported as the value of the field they point to
+            return field.target_field
+        else:
+            return field
+
+    def get_facets(self):
+        # facet name: lookup (or expression with an output_field) whose values are counted
+        return dict(self.facets or {})
+
+    def get_requested_facet_names(self):
+        # facet names requested in the query string (e.g., ?_facets=type,medium), or None for all of them
+        if not self.data or self.facets_var is None:
+            return None
+        prefix = self.prefix + '-' if self.prefix else ''
+        value = self.data.get(prefix + self.facets_var, '')
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        return names if names else None
+
+    def get_unknown_facet_names(self):
+        names = self.get_requested_facet_names()
+        if names is None:
+            return []
+        facets = self.get_facets()
+        return [name for name in names if name not in facets]
+
+    def facet_counts(self, names=None):
+        # {facet name: [(value, count), ...]} for the filtered queryset, most common values first.
+        # All facets are counted in a single query (a UNION ALL of one GROUP BY per facet). Each
+        # group is keyed on 'name:value' so that rows can be told apart without grouping on a
+        # constant, which not every backend allows.
+        facets = self.get_facets()
+        if names is None:
+            names = self.get_requested_facet_names() or list(facets)
+        names = [name for name in names if name in facets]
+        if not names:
+            return {}
+
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+        parts = []
+        output_fields = {}
+        for name in names:
+            expression = facets[name]
+            if isinstance(expression, str):
+                output_fields[name] = self.get_model_field(expression, multiple=True)
+                expression = F(expression)
+            else:
+                output_fields[name] = expression.output_field
+            key = Concat(Value(name + ':'), Cast(expression, CharField()), output_field=CharField())
+            parts.append(
+                queryset.annotate(facet_key=key)
+                .values('facet_key')
+                .annotate(facet_count=Count('pk', distinct=True))
+                .order_by()
+            )
+
+        query = parts[0].union(*parts[1:], all=True) if len(parts) > 1 else parts[0]
+        counts = {name: [] for name in names}
+        for row in query:
+            name, value = row['facet_key'].split(':', 1)
+            # missing values come back as empty strings (concatenating NULL is backend-specific)
+            if value == '':
+                value = None
+            elif output_fields[name] is not None:
+                value = output_fields[name].to_python(value)
+            counts[name].append((value, row['facet_count']))
+
+        for values in counts.values():
+            values.sort(key=lambda item: (-item[1], str(item[0])))
+        return counts
+
+    def column_fields(self):
+        # output fields whose values can be read directly from database columns
+        columns = []
+        for field in self.output_fields:
+            column_key = field.get_column_key()
+            model_field = self.get_model_field(column_key) if column_key is not None else None
+            if model_field is not None:
+                columns.append((field, column_key, model_field))
+        return columns
+
+    def arrow_schema(self):
+        import pyarrow as pa
+
+        arrow_fields = []
+        for field, column_key, model_field in self.column_fields():
+            arrow_type, converter = _arrow_column(pa, model_field)
+            metadata = {'ARROW:extension:name': 'geoarrow.wkb'} if hasattr(model_field, 'geom_type') else None
+            arrow_fields.append(pa.field(field.name, arrow_type, nullable=True, metadata=metadata))
+        return pa.schema(arrow_fields)
+
+    def iter_record_batches(self, batch_size=None):
+        # builds typed columns straight from values_list() tuples in batches,
+        # without creating model instances or per-row dicts
+        import pyarrow as pa
+
+        if batch_size is None:
+            batch_size = self.export_chunk_size
+
+        schema = self.arrow_schema()
+        columns = self.column_fields()
+        converters = [_arrow_column(pa, model_field)[1] for field, column_key, model_field in columns]
+        queryset = self.assemble_queryset(paginate=False).values_list(*[key for field, key, mf in columns])
+
+        def make_batch(rows):
+            arrays = []
+            for i, (arrow_field, converter) in enumerate(zip(schema, converters)):
+                values = [row[i] for row in rows]
+                if converter is not None:
+                    values = converter(values)
+                arrays.append(pa.array(values, type=arrow_field.type))
+            return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+        rows = []
+        for row in queryset.iterator(chunk_size=batch_size):
+            rows.append(row)
+            if len(rows) >= batch_size:
+                yield make_batch(rows)
+                rows = []
+
+        if rows:
+            yield make_batch(rows)
+
+    def rowiter_arrow(self, file_format='arrow', batch_size=None):
+        import pyarrow as pa
+
+        schema = self.arrow_schema()
+        sink = _ChunkSink()
+        if file_format == 'arrow':
+            writer = pa.ipc.new_stream(pa.PythonFile(sink, mode='w'), schema)
+        elif file_format == 'parquet':
+            import pyarrow.parquet as pq
+            writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+        else:
+            raise ValueError('file_format must be "arrow" or "parquet"')
+
+        for batch in self.iter_record_batches(batch_size):
+            writer.write_batch(batch)
+            yield sink.pop()
+
+        writer.close()
+        yield sink.pop()
+
+    def header_text(self):
+        return [field.name for field in self.output_fields]
 
     def row_text(self, item):
-        return [field.value_text(item) for field in self.fields.values() if field.visible]
+        return [field.value_text(item) for field in self.output_fields]
 
     def row_html(self, item):
-        return [field.value_html(item) for field in self.fields.values() if field.visible]
+        return [field.value_html(item) for field in self.output_fields]
 
     def row_json(self, item):
-        return {field.name: field.value_json(item) for field in self.fields.values() if field.visible}
+        row = {field.name: field.value_json(item) for field in self.output_fields}
+        return self.expand_row(item, row, self.expansions)
 
     def as_json(self):
-        return json.dumps(list(self.rowiter_json()))
+        rows = list(self.rowiter_json())
+        with self.profile_stage('serialize'):
+            return json.dumps(rows)
 
     def pagination_widget(self, null_html=''):
 
@@ -415,10 +1410,15 @@ class ViewList(forms.Form):
         ON_EACH_SIDE = 3
         ON_ENDS = 2
 
+        # the last page is only known if the count is (or was recently) exact
+        known_end = getattr(paginator, 'count_accuracy', 'exact') in ('exact', 'cached')
+        # with an inexact count, the current (or next) page may be past the last counted page
+        num_pages = max(paginator.num_pages, page_num if known_end else page_num + 1)
+
         # If there are 10 or fewer pages, display links to every page.
         # Otherwise, do some fancy
-        if paginator.num_pages <= 10:
-            page_range = range(paginator.num_pages)
+        if num_pages <= 10 and known_end:
+            page_range = range(num_pages)
         else:
             # Insert "smart" pagination links, so that there are always ON_ENDS
             # links at either end of the list of pages, and there are always
@@ -427,18 +1427,21 @@ class ViewList(forms.Form):
             if page_num > (ON_EACH_SIDE + ON_ENDS):
                 page_range += [
                     *range(0, ON_ENDS), '.',
-                    *range(page_num - ON_EACH_SIDE, min(page_num + 1, paginator.num_pages)),
+                    *range(page_num - ON_EACH_SIDE, min(page_num + 1, num_pages)),
                 ]
             else:
-                page_range.extend(range(0, min(page_num + 1, paginator.num_pages)))
+                page_range.extend(range(0, min(page_num + 1, num_pages)))
 
-            if page_num < (paginator.num_pages - ON_EACH_SIDE - ON_ENDS - 1):
+            if not known_end:
+                # there are no links to the last pages, since we don't know where they are
+                page_range += [*range(page_num + 1, page_num + ON_EACH_SIDE + 1), '.']
+            elif page_num < (num_pages - ON_EACH_SIDE - ON_ENDS - 1):
                 page_range += [
                     *range(page_num + 1, page_num + ON_EACH_SIDE + 1), '.',
-                    *range(paginator.num_pages - ON_ENDS, paginator.num_pages)
+                    *range(num_pages - ON_ENDS, num_pages)
                 ]
             else:
-                page_range.extend(range(page_num + 1, paginator.num_pages))
+                page_range.extend(range(page_num + 1, num_pages))
 
         links = []
 
@@ -453,7 +1456,7 @@ class ViewList(forms.Form):
             if page_num == page.number:
                 links.append(format_html('<span class="this-page">{}</span>', page_num))
             else:
-                end = mark_safe(' class="end"') if item == paginator.num_pages - 1 else ''
+                end = mark_safe(' class="end"') if known_end and item == num_pages - 1 else ''
                 links.append(
                     format_html(
                         '<a href="?{}"{}>{}</a>',
@@ -463,6 +1466,12 @@ class ViewList(forms.Form):
                     )
                 )
 
+        if hasattr(paginator, 'count_display'):
+            links.append(
+                format_html('<span class="paginator-count">{} {}</span>', paginator.count_display(),
+                            self.object_name_plural())
+            )
+
         return mark_safe('<span class="paginator">' + " ".join(links) + '</span>')
 
     def __bool__(self):
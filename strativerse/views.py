@@ -3,6 +3,8 @@ from django.views.generic import RedirectView
 from django.http import Http404
 from django.urls import reverse_lazy
 
+from .urltemplates import cached_reverse, clear_url_templates
+
 _model_detail_urls_patterns = {}
 
 
@@ -12,6 +14,10 @@ def register_model_detail_url(model, url_id):
         model = model.__name__.lower()
 
     previous = _model_detail_urls_patterns[model] if  model in _model_detail_urls_patterns else None
+    if previous is not None:
+        # URL templates are compiled on first use, since URLs can't be reversed
+        # while the URLconf that registers them is still being imported
+        clear_url_templates(previous)
     if url_id is None:
         del _model_detail_urls_patterns[model]
     else:
@@ -23,7 +29,7 @@ def get_model_detail_url(model, pk):
     if model not in _model_detail_urls_patterns:
         return None
     else:
-        return reverse_lazy(_model_detail_urls_patterns[model], kwargs={'pk': pk})
+        return cached_reverse(_model_detail_urls_patterns[model], {'pk': pk})
 
 
 class ModelDetailRedirectView(RedirectView):
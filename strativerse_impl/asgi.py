@@ -0,0 +1,55 @@
+"""
+ASGI config for strativerse_impl project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+The API's async detail, list, and related views are used when it is served this
+way. Django 3.2 iterates streaming responses in the event loop, where the
+database can't be used and waiting for events would block every other client,
+so the API's exports and event stream are served by the WSGI application (see
+wsgi.py) instead, each in a thread of its own.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.http import QueryDict
+from django.urls import Resolver404, resolve
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'strativerse_impl.settings')
+os.environ.setdefault('STRATIVERSE_API_ASYNC', '1')
+
+django_application = get_asgi_application()
+streaming_application = WsgiToAsgi(get_wsgi_application())
+
+from strativerse.api.v1 import api  # noqa: E402 (the apps have to be loaded first)
+
+
+def is_streaming_request(scope):
+    # whether a request is for the event stream or a list export
+    path = scope['path']
+    root_path = scope.get('root_path', '')
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return False
+    if match.view_name == 'strativerse:apiv1_events':
+        return True
+    query = QueryDict(scope.get('query_string', b'').decode('latin-1'))
+    return match.view_name == 'strativerse:apiv1_list' and query.get(api.format_var, 'json') != 'json'
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and is_streaming_request(scope):
+        # (synchronous code runs in a thread for each context, rather than in a shared one)
+        async with ThreadSensitiveContext():
+            await streaming_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
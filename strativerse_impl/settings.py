@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'strativerse.metrics.MetricsMiddleware',
+    'strativerse.querybudget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,6 +90,104 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# the API response cache is invalidated from signals, so it needs to be shared
+# between processes (i.e., not local-memory) if there is more than one. The file-based
+# cache works for a single server; with more than one, use memcached (e.g.,
+# django.core.cache.backends.memcached.PyMemcacheCache) for both of the API caches, with
+# the generation tokens in an instance (or a server) of their own that never evicts keys.
+# File-based caches cull a third of their entries (or 1 / CULL_FREQUENCY) when they reach
+# MAX_ENTRIES, and list the whole directory to find out, so they are sized for list pages
+# rather than rows.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'strativerse_api': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'strativerse_api'),
+        'OPTIONS': {'MAX_ENTRIES': 5000, 'CULL_FREQUENCY': 4},
+    },
+    # a token per model (a few dozen entries at most), which is never culled
+    'strativerse_api_generations': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'strativerse_api_generations'),
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+    # rendered API rows, which are looked up a page (up to 1000 rows) at a time. Their keys
+    # include the row's modified timestamp, so a cache per process can't serve stale rows,
+    # and local memory is the only built-in backend that is fast enough for this.
+    'strativerse_rows': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'strativerse-rows',
+        'OPTIONS': {'MAX_ENTRIES': 50000, 'CULL_FREQUENCY': 10},
+    },
+}
+
+STRATIVERSE_API_CACHE = 'strativerse_api'
+STRATIVERSE_API_GENERATION_CACHE = 'strativerse_api_generations'
+STRATIVERSE_ROW_CACHE = 'strativerse_rows'
+STRATIVERSE_API_CACHE_TIMEOUT = 600
+
+# the change feed holds back changes written in the last few seconds, so that a transaction that
+# was still writing an earlier change has committed before the feed moves past it
+STRATIVERSE_CHANGE_FEED_SETTLE_SECONDS = 2
+
+# the most clients that can be connected to the event stream per process (each one holds a
+# worker thread while it is connected, so this should leave threads for other requests)
+STRATIVERSE_EVENTS_MAX_CLIENTS = 50
+
+# use the async detail, list, and related views (set by strativerse_impl/asgi.py), which run
+# their database work in a pool of this many threads per process
+STRATIVERSE_API_ASYNC = os.environ.get('STRATIVERSE_API_ASYNC', '') == '1'
+STRATIVERSE_API_ASYNC_THREADS = 16
+
+# snapshots written by manage.py strativerse_snapshot, which should be served
+# as static files from STRATIVERSE_SNAPSHOT_URL in production
+STRATIVERSE_SNAPSHOT_ROOT = os.path.join(BASE_DIR, 'snapshots')
+STRATIVERSE_SNAPSHOT_URL = '/snapshots/'
+
+# profile every API list request (timings per stage and per field are sent in a Server-Timing
+# header and logged to strativerse.viewlist); otherwise only ?profile=1 from staff (or with DEBUG)
+STRATIVERSE_PROFILE_VIEWLISTS = False
+
+# who can read /metrics (besides staff): requests with "Authorization: Bearer
+# <STRATIVERSE_METRICS_TOKEN>" (if it is set), and requests from these addresses. Addresses
+# are only meaningful when clients reach Django directly: behind a reverse proxy (e.g., nginx
+# on the same host), every request comes from the proxy's address.
+STRATIVERSE_METRICS_ALLOWED_IPS = []
+STRATIVERSE_METRICS_TOKEN = os.environ.get('STRATIVERSE_METRICS_TOKEN')
+
+# the most SQL queries a request should run, per URL name ('default' for the rest), either as a
+# number or as (max queries, max times any one query may be repeated); requests that go over are
+# logged to strativerse.querybudget, or raise QueryBudgetExceeded with the 'raise' action
+STRATIVERSE_QUERY_BUDGETS = {
+    'default': 1000,
+    'strativerse:apiv1_list': (10, 2),
+    'strativerse:apiv1_detail': (10, 2),
+    'strativerse:apiv1_bulk': (10, 2),
+    'strativerse:apiv1_facets': (10, 2),
+    'strativerse:apiv1_related': (10, 2),
+    'strativerse:apiv1_related_batch': (10, 2),
+    'strativerse:apiv1_changes': (30, 2),
+}
+STRATIVERSE_QUERY_BUDGET_ACTION = 'log'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'strativerse.viewlist': {'handlers': ['console'], 'level': 'INFO'},
+        'strativerse.querybudget': {'handlers': ['console'], 'level': 'WARNING'},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
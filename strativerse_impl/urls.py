@@ -13,10 +13,17 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
+from strativerse.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('strativerse/', include('strativerse.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
+
+# snapshot downloads (only served by Django when DEBUG is on)
+urlpatterns += static(settings.STRATIVERSE_SNAPSHOT_URL, document_root=settings.STRATIVERSE_SNAPSHOT_ROOT)